@@ -5,40 +5,35 @@ PyPlacePlayer
 P-Trip (PyPlacePlayer) is a program to read from the reddit.com/r/place dataset and display
 the information to the screen as a timelapse.
 
-2022 Dataset canvas growth times
-First X = 2022-04-02 16:24:56.239 UTC
-Sorted_Data_113.csv
-First Y = 2022-04-03 19:03:53.356 UTC
-Sorted_Data_134.csv
-
-2023 canvas size dataset changes
-X = 1000-1999, Y = 500-1499
-109
-X = 1000-2499, Y = 500-1499
-115
-X = 500-2499, Y = 500-1499
-121
-X = 500-2499, Y = 0-1499
-128
-X = 500-2499, Y = 0-1999
-132
-X = 0-2499, Y = 0-1999
-138
-X = 0-2999, Y = 0-1999
+Both canvases grew while r/place ran, 2022 twice and 2023 six times. When and where each growth happened is found from
+the event store by buildExpansions, along with the canvas just before it, so viewports in the new parts can skip
+straight to the file where that part opened.
 '''
 # imports additional python packages to handle complex functions
 import random
 import numpy as np # used to turn dataset into array of pixel values
-import pygame as pg # reads pixel array and displays images to screen
-import subprocess # executes tasks in a subprocess
 import os # used for file operations
+import subprocess # executes tasks in a subprocess
+import multiprocessing # runs dataset preparation across every core
+import argparse # reads commands given on the command line
+import heapq # merges sorted runs of the datasets
+import itertools
+import shutil
+import threading # reads the event store in the background while playing
+import queue
 from datetime import datetime
+import calendar # converts UTC time tuples into seconds since the epoch
 import time
-os.environ['SDL_AUDIODRIVER'] = 'dsp' # Don't need audio and ALSA kept crashing
-
-#  set to list of file numbers of the first data set after each canvas resize to capture starting images.
-#  Currently only set up for 2023 dataset
-getResize = False
+import sys
+import contextlib
+import json # writes benchmark reports and stats
+import bisect
+import tempfile
+import gzip # reads the compressed datasets without unpacking them to disk
+import urllib.request # streams the datasets from reddit or a file:// url
+# pygame reads pixel array and displays images to screen. It's only imported once something needs to draw, so preparing
+# and querying the data imports quickly and never needs a display
+pg = None
 
 # static constants
 #X & Y constants, will be used to define resolution of player window
@@ -46,6 +41,13 @@ NATIVE_X_RES = 800
 NATIVE_Y_RES = 600
 MAX_SCALE = 6 #   res scale will get randomized each loop with this as max
 RAND_TOLERANCE = 40
+# frames per second to draw, and how many seconds of canvas time play in each second. 360 plays an hour in 10 seconds
+FPS = 60
+PLAYBACK_SPEED = 360
+# size of the square cells used to track which parts of the screen changed, in pixel array pixels
+DIRTY_CELL = 16
+# number of batches of events the background decoder can get ahead of the screen
+DECODE_QUEUE = 240
 
 # 2022 Data set
 GRID_SIZE = 2000
@@ -74,68 +76,289 @@ D_ORDERED23 = 'Ordered_Data_23_'
 
 # extension of datasets
 D_EXT = '.csv'
-# initialize pygame
-pg.init()
-# set display resolution to X & Y constants
-screen = pg.display.set_mode((NATIVE_X_RES, NATIVE_Y_RES))# pg.display.set_mode((GRID_SIZE23_X, GRID_SIZE23_Y))#
-# initialize pygame clock, will be used to lock framerate
-clock = pg.time.Clock()
-pg.mouse.set_visible(False)
+# number of processes used to prepare the datasets
+PREP_WORKERS = os.cpu_count() or 1
+# base folder name for sorted runs while ordering, and the most megabytes of memory to use while ordering
+D_RUNS = 'Runs_'
+SORT_MEMORY_MB = 1024
+# most runs to have open at once while merging, well under the usual limit of 1024 open files
+MERGE_FILES = 256
+# how many timestamps get decoded at a time
+UTC_BLOCK = 65536
+
+# base folder names of the binary event stores built from the ordered data
+D_STORE = 'Store_Data_'
+D_STORE23 = 'Store_Data_23_'
+#  set to a folder or a file:// url holding the .gzip datasets to read them from there instead of reddit. Streaming
+#  reads the .gzip files straight into the event store, set STREAM to False to go through csv files on disk instead
+SOURCE = False
+STREAM = True
+# base folder names of the stores of each raw file before they're merged into time order
+D_RAW_STORE = 'Raw_Store_'
+D_RAW_STORE23 = 'Raw_Store_23_'
+# every color r/place ever allowed. Events and canvases store the index into this list instead of the RGB value
+PALETTE = ['#6D001A', '#BE0039', '#FF4500', '#FFA800', '#FFD635', '#FFF8B8', '#00A368', '#00CC78',
+           '#7EED56', '#00756F', '#009EAA', '#00CCC0', '#2450A4', '#3690EA', '#51E9F4', '#493AC1',
+           '#6A5CFF', '#94B3FF', '#811E9F', '#B44AC0', '#E4ABFF', '#DE107F', '#FF3881', '#FF99AA',
+           '#6D482F', '#9C6926', '#FFB470', '#000000', '#515252', '#898D90', '#D4D7D9', '#FFFFFF']
+# lookup table to turn a palette index back into RGB values
+PALETTE_RGB = np.array([[int(c[1:3], 16), int(c[3:5], 16), int(c[5:7], 16)] for c in PALETTE], dtype=np.uint8)
+# fast lookup from hex string to palette index
+PALETTE_INDEX = {c: i for i, c in enumerate(PALETTE)}
+# palette index of the blank white canvas
+WHITE = PALETTE_INDEX['#FFFFFF']
+# size of the square tiles used to find events near the window, and how many tiles cover the largest canvas
+TILE_SIZE = 100
+TILE_COLS = GRID_SIZE23_X // TILE_SIZE
+TILE_ROWS = GRID_SIZE23_Y // TILE_SIZE
+# base folder names of the keyframe snapshots, and how many minutes of canvas time between each keyframe
+D_KEYFRAMES = 'Keyframes_'
+D_KEYFRAMES23 = 'Keyframes_23_'
+KEYFRAME_MINUTES = 10
+# most megabytes of unpacked keyframes to keep in memory for seeking
+KEYFRAME_CACHE_MB = 256
+# base folder names of the activity stats of each year, how many minutes of canvas time go in each bucket of color
+# usage, and how many of the busiest TILE_SIZE regions to keep
+D_ACTIVITY = 'Activity_'
+D_ACTIVITY23 = 'Activity_23_'
+ACTIVITY_MINUTES = 1
+CONTESTED_REGIONS = 50
+# share of viewports that get picked in proportion to how busy they are instead of anywhere on the canvas, and the
+# size of the square cells the busy map is counted in
+ACTIVE_SHARE = 0.5
+DENSITY_CELL = 10
+# base folder names of the canvas growth index and base images, and the size of the blocks the canvas grows in
+D_EXPANSIONS = 'Expansions_'
+D_EXPANSIONS23 = 'Expansions_23_'
+EXPANSION_BLOCK = 500
+
+#  set to a filename to log playback stats to as json lines every STATS_INTERVAL seconds, or to 'overlay' to draw
+#  them on the screen instead
+STATS = False
+STATS_INTERVAL = 5
+
+#  set to (columns, rows) to split the window into a grid of viewports. Each one gets its own spot and scale, and all
+#  of them play from a single pass over the event store
+VIEW_GRID = (1, 1)
+
+#  set to a time like '2022-04-03 12:00:00 UTC' to start playback of that year from that moment instead of the
+#  start of the dataset. Needs the keyframes to be built.
+START_TIME = False
+
+# imports pygame the first time it's needed
+def usePygame():
+    global pg
+    if pg is None:
+        # keeps the pygame banner out of frames exported to stdout
+        os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+        import pygame
+        pg = pygame
+    return pg
+
+# maps event time to display time so an hour of canvas always takes the same time to play, however busy it was
+class FrameScheduler:
+
+    # speed is how many seconds of canvas time play in one second
+    def __init__(self, speed):
+        self.speed = speed
+        self.reset()
+
+    # start a new playback. It lines up with eventStart (ms) if given, otherwise with the first event shown
+    def reset(self, eventStart=None):
+        self.eventStart = eventStart
+        self.wallStart = None
+
+    # returns the event time in ms that should be on screen right now. nextEvent is the time of the next event
+    # waiting to be shown
+    def due(self, nextEvent):
+        now = time.perf_counter()
+        if self.eventStart is None:
+            self.eventStart = int(nextEvent)
+        if self.wallStart is None:
+            self.wallStart = now
+        return self.eventStart + int((now - self.wallStart) * self.speed * 1000)
+
+# Collects counters and timing histograms while playing and puts them out every STATS_INTERVAL seconds. A player
+# only has one when STATS is set, every place that records something checks 'if stats:' first so it costs nothing
+# when it's off
+class Stats:
+
+    # upper edges of the timing histogram buckets in ms, anything slower goes in the last bucket
+    BUCKETS = [0.5, 1, 2, 4, 8, 16, 33, 66, 133, 266]
+
+    # target is a filename for the json lines log, or 'overlay' to draw on the screen
+    def __init__(self, target, interval=STATS_INTERVAL):
+        self.overlay = target == 'overlay'
+        self.log = None if self.overlay else open(target, 'a')
+        self.interval = interval
+        self.overlaySurface = None
+        self.overlayRect = None
+        self.reset()
+
+    # start a new interval
+    def reset(self):
+        self.start = time.perf_counter()
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+
+    # adds amount to a counter
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    # records how long something took, seconds is from time.perf_counter
+    def time(self, name, seconds):
+        ms = seconds * 1000
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = {'count': 0, 'totalMs': 0, 'maxMs': 0, 'buckets': [0] * (len(self.BUCKETS) + 1)}
+        timer['count'] += 1
+        timer['totalMs'] += ms
+        timer['maxMs'] = max(timer['maxMs'], ms)
+        timer['buckets'][bisect.bisect_left(self.BUCKETS, ms)] += 1
+
+    # records the latest value of something that goes up and down, and the most it got to in the interval
+    def gauge(self, name, value):
+        gauge = self.gauges.setdefault(name, {'last': value, 'max': value})
+        gauge['last'] = value
+        gauge['max'] = max(gauge['max'], value)
+
+    # puts out the stats once the interval is up
+    def tick(self):
+        now = time.perf_counter()
+        if now - self.start < self.interval:
+            return
+        elapsed = now - self.start
+        record = {'time': round(time.time(), 3), 'seconds': round(elapsed, 3)}
+        for name, value in self.counters.items():
+            record[name] = value
+            record[name + 'PerSecond'] = round(value / elapsed, 1)
+        for name, timer in self.timers.items():
+            record[name] = {'count': timer['count'], 'meanMs': round(timer['totalMs'] / timer['count'], 3),
+                            'maxMs': round(timer['maxMs'], 3), 'buckets': timer['buckets']}
+        record.update(self.gauges)
+        if self.overlay:
+            self.makeOverlay(record)
+        else:
+            self.log.write(json.dumps(record) + '\n')
+            self.log.flush()
+        self.reset()
+
+    # turns a record into the text drawn in the corner of the screen
+    def makeOverlay(self, record):
+        lines = [f"{record.get('eventsDecodedPerSecond', 0):.0f} events/s decoded",
+                 f"{record.get('framesPerSecond', 0):.1f} fps, {record.get('droppedFrames', 0)} dropped"]
+        for name in ('frameBuild', 'render'):
+            if name in record:
+                lines.append(f"{name} {record[name]['meanMs']:.2f} ms mean, {record[name]['maxMs']:.2f} ms max")
+        if 'queueDepth' in record:
+            lines.append(f"queue {record['queueDepth']['last']} (max {record['queueDepth']['max']})")
+        font = pg.font.Font(None, 20)
+        rendered = [font.render(line, True, (255, 255, 255), (0, 0, 0)) for line in lines]
+        self.overlaySurface = pg.Surface((max(r.get_width() for r in rendered), sum(r.get_height() for r in rendered)))
+        top = 0
+        for r in rendered:
+            self.overlaySurface.blit(r, (0, top))
+            top += r.get_height()
+
+    # draws the overlay on the target surface over what's already there from surface, returns the area that changed
+    def drawOverlay(self, target, surface):
+        if self.overlaySurface is None:
+            return []
+        updates = []
+        # put back what was under the last overlay in case the new one is smaller
+        if self.overlayRect:
+            target.blit(surface, self.overlayRect, self.overlayRect)
+            updates.append(self.overlayRect)
+        self.overlayRect = target.blit(self.overlaySurface, (4, 4))
+        updates.append(self.overlayRect)
+        return updates
 
 # class to organize information from each pixel in the dataset
 class PlacePixel:
 
     # method to set values for pixel
-    def set(self, date, hTime, mTime, sTime, rgb, xPos, yPos):
+    def set(self, date, hTime, mTime, sTime, color, xPos, yPos):
         self.date = date
         self.hTime = int(hTime)
         self.mTime = int(mTime)
         self.sTime = int(sTime)
-        self.rgb = rgb
+        self.color = color
         self.xPos = xPos
         self.yPos = yPos
 
 # ------------------------------------------------ Start of code to download and sort data sets
-# check for dataset and download if needed
-def checkDataset(year,total):
+# returns the filename of a raw dataset file from reddit
+def rawName(year, ds):
     if year == 22:
         TMP_FILE = D_FILE
-        TMP_URL = D_URL
     if year == 23:
         TMP_FILE = D_FILE23
+    # numbers less than 10 will need to be padded with a 0 so that ds will always be the same length
+    if ds < 10:
+        num = '0' + str(ds)
+    else:
+        num = str(ds)
+    # makes a new string using the first 36 characters from the filename, inserting a 2 character string
+    # of the current number in the loop and adding the end of the filename back so it has the extension
+    return TMP_FILE[:36] + num + TMP_FILE[38:]
+
+# runs a list of (function, arguments) jobs, spread across a pool of processes when workers is more than 1.
+# Prints progress as each job finishes and returns the results in the order they finished.
+def runPool(jobs, label, workers=1):
+    results = []
+    if not jobs:
+        return results
+    if workers > 1:
+        with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+            for n, result in enumerate(pool.imap_unordered(runJob, jobs), 1):
+                print(f'{label}: {n}/{len(jobs)} files done')
+                results.append(result)
+            # let the workers exit on their own, pygame catches the terminate signal the pool would otherwise send
+            pool.close()
+            pool.join()
+    else:
+        for n, job in enumerate(jobs, 1):
+            results.append(runJob(job))
+            print(f'{label}: {n}/{len(jobs)} files done')
+    return results
+
+# runs one job from runPool, this has to be a top level function so the pool can send it to another process
+def runJob(job):
+    task, args = job
+    return task(*args)
+
+# downloads and decompresses one raw dataset file
+def downloadFile(year, ds):
+    if year == 22:
+        TMP_URL = D_URL
+    if year == 23:
         TMP_URL = D_URL23
-        # start a loop counting ds up through 79 values, which is 0-78. Source filenames are numbered 0-78
-    for ds in range(total):
-        # numbers less than 10 will need to be padded with a 0 so that ds will always be the same length
-        if ds < 10:
-            # adds a 0 the front and makes it a string
-            num = '0' + str(ds)
-        # numbers >= 10 already have two digits and can just be converted to a string
-        else:
-            num = str(ds)
-        # makes a new string using the first 36 characters from the filename, inserting a 2 character string
-        # of the current number in the loop and adding the end of the filename back so it has the extension
-
-        dsFile = TMP_FILE[:36] + num + TMP_FILE[38:]
-        # check to see if the file already exists
-        if not os.path.exists(dsFile):
-            # this builds a terminal command that will use the tool 'curl' to download the file and then
-            # use 'gzip' to decompress the file. The use of && makes them run in series, so the file will
-            # finish downloading before it tries to decompress it.
-            proc = 'curl -o ' + dsFile + '.gzip ' + TMP_URL + dsFile + \
-                   '.gzip && gzip -f -d -S .gzip ' + dsFile + '.gzip'
-            # starts the terminal in a subprocess
-            p = subprocess.Popen(proc, shell=True)
-            # links thread to the subprocess so it will not continue until completed
-            p.communicate()
+    dsFile = rawName(year, ds)
+    # this builds a terminal command that will use the tool 'curl' to download the file and then
+    # use 'gzip' to decompress the file. The use of && makes them run in series, so the file will
+    # finish downloading before it tries to decompress it.
+    proc = 'curl -o ' + dsFile + '.gzip ' + TMP_URL + dsFile + \
+           '.gzip && gzip -f -d -S .gzip ' + dsFile + '.gzip'
+    # starts the terminal in a subprocess
+    p = subprocess.Popen(proc, shell=True)
+    # links thread to the subprocess so it will not continue until completed
+    p.communicate()
+
+# check for dataset and download if needed
+def checkDataset(year, total, workers=1):
+    # only download the files that don't already exist
+    jobs = [(downloadFile, (year, ds)) for ds in range(total) if not os.path.exists(rawName(year, ds))]
+    runPool(jobs, f'Download {year}', workers)
     # after it checks through all filenames to make sure they have been downloaded and decompressed, it
     # launches the fixData function. ONLY NEEDED ON 2022 DATA
     if year == 22:
-        fixData(year,total)
+        fixData(year, total, workers)
 
 #  normalize data for 2023 dataset to all be positive integers
 def normalizeData(infile, outfile, year):
-    with open(outfile, 'w') as output:
+    # write to a temporary file first so a half finished file is never mistaken for a good one
+    with open(outfile + '.tmp', 'w') as output:
         with open(infile) as f:
             for line in f:
                 if year == 23:
@@ -147,42 +370,29 @@ def normalizeData(infile, outfile, year):
                         output.write(f'{utc},"{xPos},{yPos}",{hexValue}')
                     except:
                         print(f'Normalize error: {line}')
+    os.replace(outfile + '.tmp', outfile)
 
+# downloads a raw 2023 file if needed and normalizes it into its ordered file
+def normalizeFile(year, ds):
+    infile = rawName(year, ds)
+    if not os.path.exists(infile):
+        downloadFile(year, ds)
+    normalizeData(infile, sortedName(year, ds + 100), year)
 
 # makes a dictionary of start times to reorganize the dataset
-def fixData(year,total):
-    # creates an empty dictionary
-    dataFiles = {}
+def fixData(year, total, workers=1):
     if year == 22:
-        TMP_FILE = D_FILE
         TMP_SORTED = D_SORTED
-        # start a loop counting ds up through 79 values, which is 0-78. Source filenames are numbered 0-78
-    for ds in range(total):
-        # numbers less than 10 will need to be padded with a 0 so that ds will always be the same length
-        if ds < 10:
-            # adds a 0 the front and makes it a string
-            num = '0' + str(ds)
-        # numbers >= 10 already have two digits and can just be converted to a string
-        else:
-            num = str(ds)
-        # makes a new string using the first 36 characters from the filename, inserting a 2 character string
-        # of the current number in the loop and adding the end of the filename back so it has the extension
-        dsFile = TMP_FILE[:36] + num + TMP_FILE[38:]
-        # checks to make sure file exists before processing
-        if os.path.exists(dsFile):
-            # sends the filename to the sortFile function to get first time entry in seconds
-            tSeconds, filename = sortFile(year,dsFile)
-            # creates a dictionary entry with the key of time in seconds and value of filename
-            dataFiles[tSeconds] = filename
+    # sends each file that exists to the sortFile function to get first time entry in seconds
+    jobs = [(sortFile, (year, rawName(year, ds))) for ds in range(total) if os.path.exists(rawName(year, ds))]
+    # creates a dictionary entry with the key of time in seconds and value of filename
+    dataFiles = dict(result for result in runPool(jobs, f'Find start times {year}', workers) if result)
     # set count variable to starting point of 100
     count = 100
     # makes a loop going through dataFile sorted by keys
     for startTime in sorted(dataFiles):
-        # make terminal command to move the file to the new filename in order. This is how you rename a
-        # file in a Linux terminal, move to the same location but with different name
-        proc = 'mv ' + dataFiles[startTime] + ' ' + TMP_SORTED + str(count) + D_EXT
-        # starts the terminal in a subprocess so the rest of the code can continue
-        subprocess.Popen(proc, shell=True)
+        # rename the file to the new filename in order. This has to finish before ordering starts on the file
+        os.replace(dataFiles[startTime], TMP_SORTED + str(count) + D_EXT)
         # increment count variable for next pass
         count += 1
 
@@ -195,75 +405,180 @@ def sortFile(year,file):
                     utc, null, hexValue, xPos, yPos = (line.split(','))
                 if year == 23:
                     utc, null, xPos, yPos, hexValue = (line.split(','))
-                # take the first 19 characters of time value, which cuts off milliseconds and UTC label
-                # Milliseconds are cut off because the string length will change frequently, for example a time could
-                # show up as 04:20:22, 04:20:22.2, 04:20:22.22, or 04:20:22.222. This could be accounted for, but since
-                # each dataset is a large chunk of time there is no way two datasets would start within the same second
-                utc = utc[:19]
-                # this uses the datetime package to make an object that datetime recognizes as a full data and time.
-                # The entry would show up like 2022-04-01 13:04:46, so we're saying here's a string formatted as
-                # year-month-day hours:minutes:seconds.
-                utc = datetime.strptime(utc, "%Y-%m-%d %H:%M:%S")
-                # This converts the time object into a tuple, with is how the time package wants the data so that it
-                # can convert it into seconds since the epoch. Then subtract time since the epoch starting around the
+                # turn the time into seconds since the epoch, then subtract time since the epoch starting around the
                 # first time entry in the dataset. This last subtraction step isn't necessary since it would still be
                 # in order either way, but it just makes the numbers smaller and easier to deal with if we ever print
                 # them out during testing.
-                utc = time.mktime(utc.timetuple()) - 1648773840
+                utc = utcToMs(utc) / 1000 - 1648773840
                 # returns tuple containing the time in seconds for the first entry in the file and the filename
                 return utc, file
             except ValueError:  # skips lines from the csv that do not contain pixel data
                 print('No values')
 
-#order the contents of each dataset chronologically
-def orderDataset(year,total):
-    # start a loop counting ds up through 79 values, which is 0-78. Source filenames are numbered 0-78
+#order the contents of each dataset chronologically. Each file is sorted in chunks that fit in memory, then the
+#chunks from every file of the year are merged into one stream that is split back into files of the same sizes.
+#memory is the most megabytes all the workers together should use while sorting
+def orderDataset(year, total, workers=1, memory=SORT_MEMORY_MB):
+    jobs = []
+    # python strings and tuples take about 4 times the size of the text they hold
+    chunkBytes = memory * 1024 * 1024 // max(workers, 1) // 4
     for ds in range(100,(total+100)):
+        # only files that haven't been ordered yet still have their sorted version
+        if os.path.exists(sortedName(year, ds)):
+            jobs.append((sortRuns, (year, ds, chunkBytes)))
+    if not jobs:
+        return
+    runPool(jobs, f'Order {year}', workers)
+    mergeRuns(year, total)
+
+# returns the filename of a dataset file that has been put in order by start time but not ordered inside
+def sortedName(year, ds):
+    if year == 22:
+        return D_SORTED + str(ds) + D_EXT
+    if year == 23:
+        return D_SORTED23 + str(ds) + D_EXT
+
+# returns the filename of a dataset file that has been ordered inside
+def orderedName(year, ds):
+    if year == 22:
+        return D_ORDERED + str(ds) + D_EXT
+    if year == 23:
+        return D_ORDERED23 + str(ds) + D_EXT
+
+# sorts one dataset file into runs of at most chunkBytes of text. Each line of a run starts with its 13 digit time
+# key so the merge can compare lines without decoding the time again
+def sortRuns(year, ds, chunkBytes):
+    runDir = D_RUNS + str(year)
+    os.makedirs(runDir, exist_ok=True)
+    # the count file is written last, if it exists this file already has all its runs
+    countFile = os.path.join(runDir, f'{ds}.count')
+    if os.path.exists(countFile):
+        return
+    count = 0
+    run = 0
+    chunk = []
+    size = 0
+    with open(sortedName(year, ds)) as f:
+        for line in f:
+            # the last line of a file might not end with a newline and would get stuck to the next line
+            if not line.endswith('\n'):
+                line += '\n'
+            chunk.append(line)
+            size += len(line)
+            if size >= chunkBytes:
+                count += writeRun(os.path.join(runDir, f'{ds}_{run}{D_EXT}'), chunk)
+                run += 1
+                chunk = []
+                size = 0
+    if chunk:
+        count += writeRun(os.path.join(runDir, f'{ds}_{run}{D_EXT}'), chunk)
+        run += 1
+    with open(countFile + '.tmp', 'w') as f:
+        f.write(f'{count} {run}')
+    os.replace(countFile + '.tmp', countFile)
+
+# sorts a chunk of lines by time and writes it as a run, returns how many lines were written. Sorting is stable and
+# nothing is collapsed, so lines with the same time keep their order and identical lines are all kept
+def writeRun(runFile, chunk):
+    # every line starts with its timestamp, so all of them can be decoded in one go
+    keys = utcToMsArray(np.array([line[:line.find(',')] for line in chunk], dtype='S32'))
+    # skips lines from the csv that do not contain pixel data
+    for i in np.flatnonzero(keys < 0):
+        print(f'No pixel data: {chunk[i]}')
+    order = np.argsort(keys, kind='stable')
+    order = order[keys[order] >= 0]
+    with open(runFile + '.tmp', 'w') as f:
+        for i in order:
+            f.write(f'{keys[i]:013d},{chunk[i]}')
+    os.replace(runFile + '.tmp', runFile)
+    return len(order)
+
+# merges runs into one bigger run, keeping the time key on each line
+def mergeFiles(runNames, outFile):
+    runFiles = [open(runName) for runName in runNames]
+    with open(outFile + '.tmp', 'w') as f:
+        f.writelines(heapq.merge(*runFiles, key=lambda line: line[:13]))
+    for runFile in runFiles:
+        runFile.close()
+    os.replace(outFile + '.tmp', outFile)
+
+# merges every run of a year into one stream in time order and writes it back out as ordered files, each holding
+# as many lines as its sorted file had so the file numbers still line up with the canvas growth times
+def mergeRuns(year, total):
+    runDir = D_RUNS + str(year)
+    counts = []
+    runNames = []
+    for ds in range(100, (total + 100)):
+        countFile = os.path.join(runDir, f'{ds}.count')
+        if not os.path.exists(countFile):
+            continue
+        with open(countFile) as f:
+            count, runs = f.read().split()
+        counts.append((ds, int(count)))
+        # runs are merged in file order so lines with the same time stay in the order they came in
+        runNames += [os.path.join(runDir, f'{ds}_{run}{D_EXT}') for run in range(int(runs))]
+    # with more runs than can be open at once, runs next to each other get merged into bigger runs first. They stay
+    # in the same order so lines with the same time still do too
+    level = 0
+    while len(runNames) > MERGE_FILES:
+        bigger = []
+        for n in range(0, len(runNames), MERGE_FILES):
+            bigger.append(os.path.join(runDir, f'merge{level}_{len(bigger)}{D_EXT}'))
+            mergeFiles(runNames[n:n + MERGE_FILES], bigger[-1])
+            # the first runs are kept until the end so the merge can be started again, bigger ones aren't needed
+            if level:
+                for runName in runNames[n:n + MERGE_FILES]:
+                    os.remove(runName)
+        runNames = bigger
+        level += 1
+    runFiles = [open(runName) for runName in runNames]
+    merged = heapq.merge(*runFiles, key=lambda line: line[:13])
+    for ds, count in counts:
+        outFile = orderedName(year, ds)
+        with open(outFile + '.tmp', 'w') as f:
+            # strip the time key back off of each line
+            for line in itertools.islice(merged, count):
+                f.write(line[14:])
+        os.replace(outFile + '.tmp', outFile)
+    for runFile in runFiles:
+        runFile.close()
+    # everything is ordered, so the sorted files and runs aren't needed anymore
+    for ds, count in counts:
+        os.remove(sortedName(year, ds))
+    shutil.rmtree(runDir)
+
+# downloads, orders, converts and keyframes a whole year with a pool of processes. Every step skips the files that
+# are already finished so it can be stopped and started again
+def prepare(year, workers=PREP_WORKERS, memory=SORT_MEMORY_MB, source=SOURCE):
+    setTime = time.time()
+    if year == 22:
+        total = COUNT22
+    if year == 23:
+        total = COUNT23
+    # csv files left over from before streaming get finished the old way instead of downloading everything again
+    csvStarted = any(os.path.exists(name(year, ds)) for name in (sortedName, orderedName) for ds in (100, total + 99))
+    if STREAM and not csvStarted:
+        streamDataset(year, total, workers, memory, source)
+    else:
         if year == 22:
-            dsFile = D_SORTED + str(ds) + D_EXT
-            outFile = D_ORDERED + str(ds) + D_EXT
+            # the raw files are renamed once their order is known, so only fetch them if that hasn't happened yet
+            if not (os.path.exists(D_SORTED + '178' + D_EXT) or os.path.exists(D_ORDERED + '178' + D_EXT)):
+                checkDataset(year, total, workers)
         if year == 23:
-            dsFile = D_SORTED23 + str(ds) + D_EXT
-            outFile = D_ORDERED23 + str(ds) + D_EXT
-        # checks to make sure file exists before processing
-        if os.path.exists(dsFile):
-            # creates an empty dictionary
-            dataFiles = {}
-            # opens a file and also handles closing the file when done
-            with open(dsFile) as f:
-                # iterate through each line of text
-                for line in f:
-                    # try adds exception handling so program will not crash on errors
-                    try:
-                        # split line at every comma and assign each comma separated value to a variable
-                        if year == 22:
-                            try:
-                                utc, null, hexValue, xPos, yPos = (line.split(','))
-                            except:
-                                print('Moderation stuff')
-                                #utc, null, hexValue, xPos, yPos, xPos2, yPos2 = (line.split(','))
-                        if year == 23:
-                            try:
-                                utc, null, xPos, yPos, hexValue = (line.split(','))
-                            except:
-                                print('Moderation stuff')
-                        utc = utc[:23]
-                        if not utc[22:].isdigit():
-                            utc = utc[:22]
-                            if not utc[21:].isdigit():
-                                utc = utc[:21]
-                                if not utc[20:].isdigit():
-                                    utc = utc[:19] + '.0'
-                        utc = datetime.strptime(utc, "%Y-%m-%d %H:%M:%S.%f")
-                        dataFiles[line] = utc
-                    except:
-                        print('No pixel data')
-            sortData = {k: v for k, v in sorted(dataFiles.items(), key=lambda x: x[1])}
-            sortData = sortData.keys()
-            with open(outFile, 'w') as f:
-                for k in sortData:
-                    f.write(k)
-            os.remove(dsFile)
+            # 2023 files are normalized into their sorted file, only if they haven't been normalized or ordered yet
+            jobs = [(normalizeFile, (year, ds)) for ds in range(total)
+                    if not (os.path.exists(sortedName(year, ds + 100)) or os.path.exists(orderedName(year, ds + 100)))]
+            runPool(jobs, f'Normalize {year}', workers)
+        orderDataset(year, total, workers, memory)
+        # convert the ordered data into the binary event store so playback doesn't have to parse text
+        convertDataset(year, total, workers)
+    # snapshot the canvas every few minutes once the whole year has been converted so playback can start anywhere
+    if os.path.exists(storeName(year, total + 99)):
+        buildKeyframes(year, total)
+        buildActivity(year, total)
+        buildExpansions(year, total)
+    setTime = time.time() - setTime
+    print(f'20{year} dataset prepared in {setTime:.1f} seconds')
 
 #  Check Dataset for spots that canvas size changes
 def rangeCheck(infile,year):
@@ -300,8 +615,1012 @@ def rangeCheck(infile,year):
     print(f'{infile}: xMin = {xMin}: xMax = {xMax}: yMin = {yMin}: yMax = {yMax}')
 # ------------------------------------------------ End of code to download and sort data sets
 
-# Reads data file into a list and sends it to pygame for display
-def readFile(file, dataSet, xOffset, yOffset,year,filenumber):
+# ------------------------------------------------ Start of code to build the binary event store
+# Each ordered csv gets converted once into a folder of fixed width numpy columns, one .npy file per column:
+#   t.npy  int64   time of the event in milliseconds since the epoch
+#   x.npy  uint16  x position on the canvas
+#   y.npy  uint16  y position on the canvas
+#   c.npy  uint8   index into PALETTE
+# The columns are memory-mapped when loaded so playback is array slicing instead of parsing text.
+# Next to the columns is a spatial index that buckets the events into TILE_SIZE square tiles:
+#   order.npy  int32  event numbers grouped by tile, still in time order within each tile
+#   tiles.npy  int64  where each tile's events start in order.npy, with one extra entry for the end
+# 2022 moderators also covered whole rectangles in one color. Those are kept apart from the pixels since one of them
+# can cover thousands of pixels:
+#   rects.npy  int64  rows of [time in ms, x1, y1, x2, y2, palette index] in time order, corners included. A rectangle
+#                     fills after every pixel with the same time or earlier
+
+# turns a hex color like '#FF4500' into its palette index
+def paletteIndex(hexValue):
+    hexValue = hexValue.strip().upper()
+    try:
+        return PALETTE_INDEX[hexValue]
+    except KeyError:
+        # unknown color, use the closest palette entry so the event is not lost
+        rgb = np.array([int(hexValue[1:3], 16), int(hexValue[3:5], 16), int(hexValue[5:7], 16)])
+        index = int(np.argmin(((PALETTE_RGB.astype(np.int32) - rgb) ** 2).sum(axis=1)))
+        print(f'Unknown color {hexValue}, using {PALETTE[index]}')
+        PALETTE_INDEX[hexValue] = index
+        return index
+
+# Timestamps in both datasets are always laid out the same way, 'YYYY-MM-DD HH:MM:SS[.fff] UTC', so every part of
+# them can be read straight from its position instead of going through datetime.strptime. Milliseconds can show up
+# as .2, .22, .222 or be missing completely, so they're padded out to 3 digits.
+
+# milliseconds since the epoch at the start of each date seen so far, there are only a handful of dates per dataset
+DAY_MS = {}
+
+# turns a timestamp like '2022-04-04 00:53:51.577 UTC' into milliseconds since the epoch
+def utcToMs(utc):
+    try:
+        ms = DAY_MS[utc[:10]]
+    except KeyError:
+        # first time this date has shown up, datetime also checks that it's really a date
+        ms = calendar.timegm(datetime.strptime(utc[:10], "%Y-%m-%d").timetuple()) * 1000
+        DAY_MS[utc[:10]] = ms
+    ms += int(utc[11:13]) * 3600000 + int(utc[14:16]) * 60000 + int(utc[17:19]) * 1000
+    if utc[19:20] == '.':
+        end = utc.find(' ', 20)
+        ms += int(utc[20:end if end > 0 else None][:3].ljust(3, '0'))
+    return ms
+
+# turns a whole numpy column of timestamps stored as bytes (dtype 'S') into milliseconds since the epoch.
+# Rows that aren't a timestamp come back as -1
+def utcToMsArray(stamps):
+    stamps = np.ascontiguousarray(stamps)
+    if stamps.dtype.kind != 'S' or stamps.dtype.itemsize < 23:
+        stamps = stamps.astype(f'S{max(stamps.dtype.itemsize, 23)}')
+    # view every timestamp as a row of character codes without copying them, only the first 23 get looked at
+    chars = stamps.view(np.uint8).reshape(-1, stamps.dtype.itemsize)[:, :23]
+    ms = np.empty(len(stamps), dtype=np.int64)
+    # a block at a time so the working arrays stay small however many timestamps there are
+    for pos in range(0, len(stamps), UTC_BLOCK):
+        ms[pos:pos + UTC_BLOCK] = utcBlockToMs(chars[pos:pos + UTC_BLOCK])
+    return ms
+
+# turns rows of timestamp character codes into milliseconds since the epoch, -1 for rows that aren't a timestamp
+def utcBlockToMs(chars):
+    # every part of the date fits in 32 bits, only the milliseconds since the epoch need 64
+    chars = chars.astype(np.int32)
+    digits = chars - ord('0')
+    isDigit = (digits >= 0) & (digits <= 9)
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 5] * 10 + digits[:, 6]
+    day = digits[:, 8] * 10 + digits[:, 9]
+    # days since the epoch for a year, month and day. Counts from March so the leap day is at the end of the year
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    days = era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+    ms = (days.astype(np.int64) * 86400 + (digits[:, 11] * 10 + digits[:, 12]) * 3600 +
+          (digits[:, 14] * 10 + digits[:, 15]) * 60 + digits[:, 17] * 10 + digits[:, 18]) * 1000
+    # each millisecond digit only counts if it and every digit before it is there
+    fraction = chars[:, 19] == ord('.')
+    for place, scale in ((20, 100), (21, 10), (22, 1)):
+        fraction = fraction & isDigit[:, place]
+        ms += np.where(fraction, digits[:, place], 0) * scale
+    # check the layout so anything that isn't a timestamp, like the csv header, gets thrown out
+    valid = isDigit[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]].all(axis=1)
+    valid &= (chars[:, 4] == ord('-')) & (chars[:, 7] == ord('-')) & (chars[:, 10] == ord(' '))
+    valid &= (chars[:, 13] == ord(':')) & (chars[:, 16] == ord(':'))
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    return np.where(valid, ms, -1)
+
+# returns the folder name of the event store for a file number
+def storeName(year, ds):
+    if year == 22:
+        return D_STORE + str(ds)
+    if year == 23:
+        return D_STORE23 + str(ds)
+
+# converts one ordered csv into a folder of numpy columns
+def convertFile(infile, outdir, year, index=True):
+    tCol = []
+    xCol = []
+    yCol = []
+    cCol = []
+    rects = []
+    with open(infile) as f:
+        for line in f:
+            try:
+                if year == 22:
+                    fields = line.split(',')
+                    # moderation rectangles have two corners instead of one position
+                    if len(fields) == 7:
+                        rects.append(rectRow(fields[0], fields[2], fields[3:]))
+                        continue
+                    utc, null, hexValue, xPos, yPos = fields
+                if year == 23:
+                    utc, xPos, yPos, hexValue = line.split(',')
+                xPos = int(xPos.strip('"'))
+                yPos = int(yPos.strip('"\n'))
+                tCol.append(utc)
+                xCol.append(xPos)
+                yCol.append(yPos)
+                cCol.append(paletteIndex(hexValue))
+            except ValueError:  # skips lines from the csv that do not contain pixel data
+                print(f'Convert error: {line}')
+    # decode all the timestamps in one go and drop any that aren't real timestamps
+    tCol = utcToMsArray(np.array(tCol, dtype='S32'))
+    valid = tCol >= 0
+    if not valid.all():
+        print(f'Convert error: {np.count_nonzero(~valid)} bad timestamps in {infile}')
+    # write to a temporary folder first so a half finished store is never mistaken for a good one
+    tmpdir = outdir + '.tmp'
+    os.makedirs(tmpdir, exist_ok=True)
+    np.save(os.path.join(tmpdir, 't.npy'), tCol[valid])
+    np.save(os.path.join(tmpdir, 'x.npy'), np.array(xCol, dtype=np.uint16)[valid])
+    np.save(os.path.join(tmpdir, 'y.npy'), np.array(yCol, dtype=np.uint16)[valid])
+    np.save(os.path.join(tmpdir, 'c.npy'), np.array(cCol, dtype=np.uint8)[valid])
+    saveRects(tmpdir, rects)
+    # the benchmark leaves the tile index out to time it on its own
+    if index:
+        buildTileIndex(tmpdir)
+    os.replace(tmpdir, outdir)
+
+# turns the time, color and four corners of a 2022 moderation line, like '"x1', 'y1', 'x2', 'y2"', into a rectangle
+def rectRow(utc, hexValue, corners):
+    x1, y1, x2, y2 = (int(n.strip('"\n')) for n in corners)
+    return [utcToMs(utc), min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2), paletteIndex(hexValue)]
+
+# saves the moderation rectangles of an event store in time order
+def saveRects(storeDir, rects):
+    rects = np.array(rects, dtype=np.int64).reshape(-1, 6)
+    np.save(os.path.join(storeDir, 'rects.npy'), rects[np.argsort(rects[:, 0], kind='stable')])
+
+# returns the moderation rectangles of an event store, stores without any have no rects.npy
+def loadRects(storeDir):
+    rectFile = os.path.join(storeDir, 'rects.npy')
+    if os.path.exists(rectFile):
+        return np.load(rectFile)
+    return np.zeros((0, 6), dtype=np.int64)
+
+# fills a moderation rectangle into a canvas showing the part of the full canvas at xOffset, yOffset with one slice
+# assignment. Returns the part of the canvas that was filled as x1, y1, x2, y2 (not included), or None if the
+# rectangle is outside of it
+def fillRect(canvas, rect, xOffset=0, yOffset=0):
+    null, x1, y1, x2, y2, color = (int(n) for n in rect)
+    x1 = max(x1 - xOffset, 0)
+    y1 = max(y1 - yOffset, 0)
+    x2 = min(x2 - xOffset + 1, canvas.shape[0])
+    y2 = min(y2 - yOffset + 1, canvas.shape[1])
+    if x1 >= x2 or y1 >= y2:
+        return None
+    canvas[x1:x2, y1:y2] = color
+    return x1, y1, x2, y2
+
+# buckets the events of an event store into tiles so only the events near the window need to be read
+def buildTileIndex(storeDir):
+    null, xCol, yCol, null = loadStore(storeDir)
+    tile = (yCol // TILE_SIZE).astype(np.int64) * TILE_COLS + (xCol // TILE_SIZE)
+    # a stable sort keeps the events of each tile in time order
+    order = np.argsort(tile, kind='stable').astype(np.int32)
+    tiles = np.zeros(TILE_COLS * TILE_ROWS + 1, dtype=np.int64)
+    tiles[1:] = np.cumsum(np.bincount(tile, minlength=TILE_COLS * TILE_ROWS))
+    np.save(os.path.join(storeDir, 'order.npy'), order)
+    np.save(os.path.join(storeDir, 'tiles.npy'), tiles)
+
+# returns the numbers of the events in the tiles that touch a window, in time order
+def tileEvents(storeDir, xOffset, yOffset, width, height):
+    order = np.load(os.path.join(storeDir, 'order.npy'), mmap_mode='r')
+    tiles = np.load(os.path.join(storeDir, 'tiles.npy'))
+    xFirst = max(xOffset, 0) // TILE_SIZE
+    xLast = min((xOffset + width - 1) // TILE_SIZE, TILE_COLS - 1)
+    yFirst = max(yOffset, 0) // TILE_SIZE
+    yLast = min((yOffset + height - 1) // TILE_SIZE, TILE_ROWS - 1)
+    chunks = []
+    for row in range(yFirst, yLast + 1):
+        # tiles in the same row are next to each other in order.npy so each row is one slice
+        chunks.append(order[tiles[row * TILE_COLS + xFirst]:tiles[row * TILE_COLS + xLast + 1]])
+    events = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+    # putting the event numbers back in order puts the events back in time order
+    events.sort()
+    return events
+
+# converts every ordered csv for a year into the binary event store
+def convertDataset(year, total, workers=1):
+    jobs = []
+    for ds in range(100, (total + 100)):
+        dsFile = orderedName(year, ds)
+        outdir = storeName(year, ds)
+        # only convert files that exist and haven't been converted yet
+        if os.path.exists(dsFile) and not os.path.exists(outdir):
+            jobs.append((convertFile, (dsFile, outdir, year)))
+        # stores built before the tile index existed just need the index added
+        elif os.path.exists(outdir) and not os.path.exists(os.path.join(outdir, 'tiles.npy')):
+            jobs.append((buildTileIndex, (outdir,)))
+    runPool(jobs, f'Convert {year}', workers)
+
+# numpy doesn't promise which write wins when a position shows up more than once, so this returns the index of
+# only the last placement for each position. Searching the reversed order makes np.unique return the last occurrence.
+def lastPlacement(xPos, yPos, height):
+    spot = xPos.astype(np.int64) * height + yPos
+    null, last = np.unique(spot[::-1], return_index=True)
+    return len(spot) - 1 - last
+
+# memory-maps the columns of an event store, returns t, x, y, c arrays
+def loadStore(storeDir):
+    return tuple(np.load(os.path.join(storeDir, col + '.npy'), mmap_mode='r') for col in ('t', 'x', 'y', 'c'))
+# ------------------------------------------------ End of code to build the binary event store
+
+# ------------------------------------------------ Start of code to stream the datasets into the event store
+# Instead of unpacking every .gzip file to a csv and writing it out again while sorting, each file is read as a stream
+# and parsed straight into numpy columns. Each raw file becomes a raw store sorted by time, then all of the raw stores
+# of a year are merged a chunk at a time into the numbered event stores playback reads.
+
+# returns where a raw dataset file can be read from, either a url or a path in a local folder
+def sourceName(year, ds, source=SOURCE):
+    dsFile = rawName(year, ds) + '.gzip'
+    if not source:
+        if year == 22:
+            return D_URL + dsFile
+        if year == 23:
+            return D_URL23 + dsFile
+    # http, https and file:// urls all get opened by urllib
+    if '://' in source:
+        return source.rstrip('/') + '/' + dsFile
+    return os.path.join(source, dsFile)
+
+# returns the folder name of the store of one raw file before merging
+def rawStoreName(year, ds):
+    if year == 22:
+        return D_RAW_STORE + str(ds)
+    if year == 23:
+        return D_RAW_STORE23 + str(ds)
+
+# reads one .gzip dataset file as a stream and saves its events sorted by time as a raw store. memory is the most
+# megabytes to use. Whenever the events read so far would take more than that, they're sorted and saved as a run, and
+# the runs get merged into the raw store at the end
+def streamFile(year, ds, source=SOURCE, memory=SORT_MEMORY_MB):
+    outdir = rawStoreName(year, ds)
+    if os.path.exists(outdir):
+        return
+    # start over if reading the file was stopped part way
+    tmpdir = outdir + '.tmp'
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    os.makedirs(tmpdir)
+    # each event takes about 200 bytes while it's held in python lists
+    runEvents = max(memory * 1024 * 1024 // 200, 1024)
+    path = sourceName(year, ds, source)
+    tCol = []
+    xCol = []
+    yCol = []
+    cCol = []
+    rects = []
+    runDirs = []
+    raw = urllib.request.urlopen(path) if '://' in path else open(path, 'rb')
+    with raw, gzip.open(raw, 'rt') as f:
+        for line in f:
+            try:
+                if year == 22:
+                    fields = line.split(',')
+                    # moderation rectangles have two corners instead of one position
+                    if len(fields) == 7:
+                        rects.append(rectRow(fields[0], fields[2], fields[3:]))
+                        continue
+                    utc, null, hexValue, xPos, yPos = fields
+                    xPos = int(xPos.strip('"'))
+                    yPos = int(yPos.strip('"\n'))
+                if year == 23:
+                    utc, null, xPos, yPos, hexValue = line.split(',')
+                    # 2023 positions are centered on 0, move them so they're all positive like the 2022 data
+                    xPos = int(xPos.strip('"')) + 1500
+                    yPos = int(yPos.strip('"')) + 1000
+                cCol.append(paletteIndex(hexValue))
+                tCol.append(utc)
+                xCol.append(xPos)
+                yCol.append(yPos)
+            except ValueError:  # skips lines from the csv that do not contain pixel data
+                print(f'Stream error: {line}')
+            if len(tCol) >= runEvents:
+                runDirs.append(saveRun(os.path.join(tmpdir, f'run{len(runDirs)}'), tCol, xCol, yCol, cCol))
+                tCol, xCol, yCol, cCol = [], [], [], []
+    if tCol or not runDirs:
+        runDirs.append(saveRun(os.path.join(tmpdir, f'run{len(runDirs)}'), tCol, xCol, yCol, cCol))
+    # a file that fit in one run is already in order, otherwise its runs get merged a chunk at a time
+    if len(runDirs) == 1:
+        for name in ('t', 'x', 'y', 'c'):
+            os.replace(os.path.join(runDirs[0], name + '.npy'), os.path.join(tmpdir, name + '.npy'))
+    else:
+        runs = [loadStore(runDir) for runDir in runDirs]
+        count = sum(len(run[0]) for run in runs)
+        chunk = max(memory * 1024 * 1024 // (13 * 4 * len(runs)), 1024)
+        columns = [np.lib.format.open_memmap(os.path.join(tmpdir, name + '.npy'), mode='w+', dtype=col.dtype,
+                                             shape=(count,)) for name, col in zip(('t', 'x', 'y', 'c'), runs[0])]
+        filled = 0
+        for merged in mergeChunks(runs, chunk):
+            for column, col in zip(columns, merged):
+                column[filled:filled + len(col)] = col
+            filled += len(merged[0])
+        for column in columns:
+            column.flush()
+        del columns, runs
+    for runDir in runDirs:
+        shutil.rmtree(runDir)
+    saveRects(tmpdir, rects)
+    os.replace(tmpdir, outdir)
+
+# decodes the timestamps of parsed events, drops any that aren't real timestamps, and saves the rest in time order as
+# store columns in runDir. Returns runDir
+def saveRun(runDir, tCol, xCol, yCol, cCol):
+    tCol = utcToMsArray(np.array(tCol, dtype='S32'))
+    order = np.argsort(tCol, kind='stable')
+    order = order[tCol[order] >= 0]
+    os.makedirs(runDir, exist_ok=True)
+    np.save(os.path.join(runDir, 't.npy'), tCol[order])
+    np.save(os.path.join(runDir, 'x.npy'), np.array(xCol, dtype=np.uint16)[order])
+    np.save(os.path.join(runDir, 'y.npy'), np.array(yCol, dtype=np.uint16)[order])
+    np.save(os.path.join(runDir, 'c.npy'), np.array(cCol, dtype=np.uint8)[order])
+    return runDir
+
+# merges runs of store columns that are each in time order, chunk events of each run at a time starting from
+# positions, and yields the merged columns a piece at a time. Events come out in order of time, then run, then place
+# in the run
+def mergeChunks(runs, chunk, positions=None):
+    counts = [len(run[0]) for run in runs]
+    positions = list(positions or [0] * len(runs))
+    while any(pos < count for pos, count in zip(positions, counts)):
+        # nothing after the earliest time at the end of a chunk can be placed yet, since a later chunk of that
+        # run might have events before it. Runs that fit in their chunk can go all the way to the end. Every event
+        # at the cut time goes in, even past the end of a chunk, so events with the same time never get split up
+        cut = min((run[0][pos + chunk - 1] for run, pos, count in zip(runs, positions, counts) if pos + chunk < count),
+                  default=None)
+        pieces = []
+        for n, run in enumerate(runs):
+            pos = positions[n]
+            end = counts[n]
+            if cut is not None:
+                end = pos + int(np.searchsorted(run[0][pos:], cut, side='right'))
+            pieces.append([col[pos:end] for col in run])
+            positions[n] = end
+        # pieces are joined in run order and sorted stably so events with the same time keep the order they came in
+        merged = [np.concatenate(col) for col in zip(*pieces)]
+        order = np.argsort(merged[0], kind='stable')
+        yield [col[order] for col in merged]
+
+# streams every raw file of a year into raw stores, then merges them into the event stores
+def streamDataset(year, total, workers=1, memory=SORT_MEMORY_MB, source=SOURCE):
+    # the raw stores are removed once the merge finishes, so there's nothing to do if the last store is there
+    if os.path.exists(storeName(year, total + 99)):
+        return
+    # the memory is shared between the files being read at the same time
+    jobs = [(streamFile, (year, ds, source, memory // workers)) for ds in range(total)
+            if not os.path.exists(rawStoreName(year, ds))]
+    runPool(jobs, f'Stream {year}', workers)
+    mergeStores(year, total, memory)
+
+# writes an empty store for each raw file with no pixels that comes next, so the store numbers never skip one. The
+# last store takes every rectangle that's left even when it has no pixels
+def writeEmptyStores(year, raws, counts, out, rects, index):
+    while out < len(counts) and not counts[out]:
+        tmpdir = storeName(year, out + 100) + '.tmp'
+        os.makedirs(tmpdir, exist_ok=True)
+        for name, col in zip(('t', 'x', 'y', 'c'), raws[out]):
+            np.save(os.path.join(tmpdir, name + '.npy'), np.zeros(0, dtype=col.dtype))
+        rectEnd = len(rects) if out == len(counts) - 1 else 0
+        saveRects(tmpdir, rects[:rectEnd])
+        rects = rects[rectEnd:]
+        if index:
+            buildTileIndex(tmpdir)
+        os.replace(tmpdir, storeName(year, out + 100))
+        print(f'Merge {year}: {out + 1}/{len(counts)} files done')
+        out += 1
+    return out, rects
+
+# merges the raw stores of a year into one stream in time order and writes it out as event stores, each holding as
+# many events as its raw file had so the file numbers still line up with the canvas growth times. memory is the most
+# megabytes to use while merging. Without index the stores are left without their tile index
+def mergeStores(year, total, memory=SORT_MEMORY_MB, index=True):
+    rawDirs = [rawStoreName(year, ds) for ds in range(total) if os.path.exists(rawStoreName(year, ds))]
+    # the rectangles are few enough to sort in memory. Each one goes in the store holding the last pixel before it
+    rects = np.concatenate([loadRects(rawDir) for rawDir in rawDirs] + [np.zeros((0, 6), dtype=np.int64)])
+    rects = rects[np.argsort(rects[:, 0], kind='stable')]
+    raws = [loadStore(rawDir) for rawDir in rawDirs]
+    # 2022 files aren't in time order, so they're numbered by their first event like fixData does. Files with no
+    # pixels still get an empty store, at the end, so the stores always run from 100 to total + 99
+    if year == 22:
+        raws.sort(key=lambda raw: (not len(raw[0]), raw[0][0] if len(raw[0]) else 0))
+    counts = [len(raw[0]) for raw in raws]
+    # each event is 13 bytes, and a chunk gets copied about 4 times while it's merged
+    chunk = max(memory * 1024 * 1024 // (13 * 4 * max(len(raws), 1)), 1024)
+    positions = [0] * len(raws)
+    out = 0
+    filled = 0
+    columns = None
+    # Events come out in order of time, then raw file, then place in the file. So if the merge was stopped part way,
+    # the stores it finished hold every event from before the last time in the last of them, plus the first few at
+    # that time taken file by file. Those are skipped and the merge carries on from the next store
+    while out < len(counts) and os.path.exists(storeName(year, out + 100)):
+        out += 1
+    done = [n for n in range(out) if counts[n]]
+    if done:
+        last = int(loadStore(storeName(year, done[-1] + 100))[0][-1])
+        positions = [int(np.searchsorted(raw[0], last, side='left')) for raw in raws]
+        tied = sum(counts[:out]) - sum(positions)
+        for n, raw in enumerate(raws):
+            take = min(int(np.searchsorted(raw[0], last, side='right')) - positions[n], tied)
+            positions[n] += take
+            tied -= take
+        rects = rects[int(np.searchsorted(rects[:, 0], last, side='right')):]
+    if out:
+        print(f'Merge {year}: {out}/{len(counts)} files already done')
+    out, rects = writeEmptyStores(year, raws, counts, out, rects, index)
+    for merged in mergeChunks(raws, chunk, positions):
+        start = 0
+        while start < len(merged[0]):
+            if columns is None:
+                tmpdir = storeName(year, out + 100) + '.tmp'
+                os.makedirs(tmpdir, exist_ok=True)
+                columns = [np.lib.format.open_memmap(os.path.join(tmpdir, name + '.npy'), mode='w+',
+                                                     dtype=col.dtype, shape=(counts[out],))
+                           for name, col in zip(('t', 'x', 'y', 'c'), merged)]
+            take = min(counts[out] - filled, len(merged[0]) - start)
+            for column, col in zip(columns, merged):
+                column[filled:filled + take] = col[start:start + take]
+            filled += take
+            start += take
+            # this store is full, finish it off and move on to the next one
+            if filled == counts[out]:
+                for column in columns:
+                    column.flush()
+                columns = None
+                # the last store takes every rectangle that's left
+                rectEnd = len(rects) if out == len(counts) - 1 else int(np.searchsorted(rects[:, 0], merged[0][start - 1],
+                                                                                        side='right'))
+                saveRects(tmpdir, rects[:rectEnd])
+                rects = rects[rectEnd:]
+                if index:
+                    buildTileIndex(tmpdir)
+                os.replace(tmpdir, storeName(year, out + 100))
+                print(f'Merge {year}: {out + 1}/{len(counts)} files done')
+                out += 1
+                filled = 0
+                out, rects = writeEmptyStores(year, raws, counts, out, rects, index)
+    # everything is in the event stores, so the raw stores aren't needed anymore
+    del raws
+    for ds in range(total):
+        if os.path.exists(rawStoreName(year, ds)):
+            shutil.rmtree(rawStoreName(year, ds))
+# ------------------------------------------------ End of code to stream the datasets into the event store
+
+# ------------------------------------------------ Start of code to build and use keyframes
+# Every KEYFRAME_MINUTES of canvas time a snapshot of the whole canvas is saved as a compressed array of palette
+# indexes. index.npy holds one row per keyframe of [time in ms, store file number, event number in that file], so
+# the keyframe is the canvas from before that event. The byte offset in each store column is the event number times
+# the size of that column's type. Starting anywhere is then one keyframe load plus replaying a few minutes of events.
+# Keyframes that have been unpacked are kept in memory up to KEYFRAME_CACHE_MB, so seeking near the same time again
+# only slices the part of the canvas it needs instead of decompressing the whole thing every time.
+
+# returns the folder name of the keyframes for a year
+def keyframeName(year):
+    if year == 22:
+        return D_KEYFRAMES
+    if year == 23:
+        return D_KEYFRAMES23
+
+# returns the size of the full canvas for a year
+def canvasSize(year):
+    if year == 22:
+        return GRID_SIZE, GRID_SIZE
+    if year == 23:
+        return GRID_SIZE23_X, GRID_SIZE23_Y
+
+# writes palette indexes into a canvas, last placement on each position wins
+def applyEvents(canvas, xPos, yPos, colors):
+    last = lastPlacement(xPos, yPos, canvas.shape[1])
+    canvas[xPos[last], yPos[last]] = colors[last]
+
+# writes pixels in time order and moderation rectangles into a canvas showing the part of the full canvas at xOffset,
+# yOffset. Each rectangle fills after the pixels with the same time or earlier, positions are relative to the canvas
+def applyTimed(canvas, tCol, xPos, yPos, colors, rects, xOffset=0, yOffset=0):
+    pos = 0
+    for rect in rects:
+        end = int(np.searchsorted(tCol, rect[0], side='right'))
+        applyEvents(canvas, xPos[pos:end], yPos[pos:end], colors[pos:end])
+        fillRect(canvas, rect, xOffset, yOffset)
+        pos = end
+    applyEvents(canvas, xPos[pos:], yPos[pos:], colors[pos:])
+
+# replays the whole event store of a year and saves a keyframe every KEYFRAME_MINUTES
+def buildKeyframes(year, total):
+    outdir = keyframeName(year)
+    # keyframes only need to be built once
+    if os.path.exists(outdir):
+        return
+    tmpdir = outdir + '.tmp'
+    os.makedirs(tmpdir, exist_ok=True)
+    step = KEYFRAME_MINUTES * 60 * 1000
+    canvas = np.full(canvasSize(year), WHITE, dtype=np.uint8)
+    index = []
+    nextTime = False
+    for ds in range(100, (total + 100)):
+        storeDir = storeName(year, ds)
+        if not os.path.exists(storeDir):
+            continue
+        tCol, xCol, yCol, cCol = loadStore(storeDir)
+        rects = loadRects(storeDir)
+        if not len(tCol):
+            applyTimed(canvas, tCol, xCol, yCol, cCol, rects)
+            continue
+        # first keyframe lands on the first whole step after the dataset starts
+        if not nextTime:
+            nextTime = (int(tCol[0]) // step + 1) * step
+        pos = 0
+        rectPos = 0
+        while True:
+            # apply everything up to the next keyframe time
+            end = int(np.searchsorted(tCol, nextTime))
+            rectEnd = int(np.searchsorted(rects[:, 0], nextTime))
+            applyTimed(canvas, tCol[pos:end], xCol[pos:end].astype(np.intp), yCol[pos:end].astype(np.intp),
+                       cCol[pos:end], rects[rectPos:rectEnd])
+            pos = end
+            rectPos = rectEnd
+            # keyframe time is past the end of this file, carry on with the next one
+            if end == len(tCol):
+                # rectangles after the last pixel of the file still come before the next file
+                applyTimed(canvas, tCol[:0], xCol[:0], yCol[:0], cCol[:0], rects[rectPos:])
+                break
+            np.savez_compressed(os.path.join(tmpdir, f'{len(index)}.npz'), canvas=canvas)
+            index.append([nextTime, ds, end])
+            nextTime += step
+    np.save(os.path.join(tmpdir, 'index.npy'), np.array(index, dtype=np.int64).reshape(-1, 3))
+    os.replace(tmpdir, outdir)
+
+# whole canvases that have been opened as read only memory maps, by file path. The canvases from before each growth
+# get opened once and then every new window is just a slice of one
+CANVASES = {}
+
+# returns the canvas saved in a .npy file as a read only memory map, opening it the first time
+def canvasMap(canvasFile):
+    canvasFile = os.path.abspath(canvasFile)
+    if canvasFile not in CANVASES:
+        CANVASES[canvasFile] = np.load(canvasFile, mmap_mode='r')
+    return CANVASES[canvasFile]
+
+# keyframe index of each year once it has been loaded
+KEYFRAMES = {}
+
+# returns the keyframe index of a year, or None if there are no keyframes
+def keyframeIndex(year):
+    if year not in KEYFRAMES:
+        indexFile = os.path.join(keyframeName(year), 'index.npy')
+        if not os.path.exists(indexFile):
+            return None
+        KEYFRAMES[year] = np.load(indexFile)
+    return KEYFRAMES[year]
+
+# unpacked keyframes by year and number, the ones used last are at the end. The lock keeps sessions playing in
+# threads from changing it at the same time
+KEYFRAME_CACHE = {}
+KEYFRAME_LOCK = threading.Lock()
+
+# returns the canvas of a keyframe, read only since it's shared. The ones used least recently get dropped once the
+# unpacked keyframes take more than KEYFRAME_CACHE_MB
+def keyframeCanvas(year, key):
+    with KEYFRAME_LOCK:
+        canvas = KEYFRAME_CACHE.pop((year, key), None)
+        if canvas is not None:
+            KEYFRAME_CACHE[(year, key)] = canvas
+            return canvas
+    with np.load(os.path.join(keyframeName(year), f'{key}.npz')) as keyframe:
+        canvas = keyframe['canvas']
+    canvas.flags.writeable = False
+    with KEYFRAME_LOCK:
+        KEYFRAME_CACHE[(year, key)] = canvas
+        limit = KEYFRAME_CACHE_MB * 1024 * 1024
+        while len(KEYFRAME_CACHE) > 1 and sum(c.nbytes for c in KEYFRAME_CACHE.values()) > limit:
+            del KEYFRAME_CACHE[next(iter(KEYFRAME_CACHE))]
+    return canvas
+
+# rebuilds part of the canvas at time t (ms) from the nearest keyframe before it. Returns the palette indexes of the
+# region plus the store file number and event number to continue playback from
+def seekCanvas(year, t, xOffset, yOffset, width, height):
+    index = keyframeIndex(year)
+    key = -1
+    if index is not None:
+        key = int(np.searchsorted(index[:, 0], t, side='right')) - 1
+    if key >= 0:
+        # only the window gets read from the keyframe, and copied so playback can write into it
+        region = keyframeCanvas(year, key)[xOffset:xOffset + width, yOffset:yOffset + height].copy()
+        ds = int(index[key, 1])
+        start = int(index[key, 2])
+        # rectangles before the keyframe time are already in it
+        rectStart = int(index[key, 0])
+    else:
+        # before the first keyframe or without keyframes, start from a blank canvas at the start of the dataset
+        region = np.full((width, height), WHITE, dtype=np.uint8)
+        ds = 100
+        start = 0
+        rectStart = None
+    # replay the events in the window from the keyframe up to the requested time
+    while os.path.exists(storeName(year, ds)):
+        storeDir = storeName(year, ds)
+        tCol, xCol, yCol, cCol = loadStore(storeDir)
+        end = int(np.searchsorted(tCol, t))
+        events = tileEvents(storeDir, xOffset, yOffset, width, height)
+        events = events[(events >= start) & (events < end)]
+        xPos = xCol[events].astype(np.intp) - xOffset
+        yPos = yCol[events].astype(np.intp) - yOffset
+        inWindow = (xPos >= 0) & (xPos < width) & (yPos >= 0) & (yPos < height)
+        rects = loadRects(storeDir)
+        rects = rects[rects[:, 0] < t]
+        if rectStart is not None:
+            rects = rects[rects[:, 0] >= rectStart]
+        applyTimed(region, tCol[events][inWindow], xPos[inWindow], yPos[inWindow], cCol[events][inWindow], rects,
+                   xOffset, yOffset)
+        # requested time is inside this file so playback continues from here
+        if end < len(tCol):
+            return region, ds, end
+        ds += 1
+        start = 0
+        rectStart = None
+    return region, ds, 0
+# ------------------------------------------------ End of code to build and use keyframes
+
+# ------------------------------------------------ Start of code to build activity stats
+# Reads a whole year of the event store once and counts where, when and in which colors the canvas was edited. Each
+# count is added up a file at a time with np.bincount. The activity folder of a year holds:
+#   pixels.npy   int32  edits of every pixel of the canvas, indexed [x, y]
+#   colors.npy   int64  placements of each palette color in every ACTIVITY_MINUTES bucket, indexed [bucket, color]
+#   seconds.npy  int32  events in every second of canvas time
+#   regions.npy  int64  the CONTESTED_REGIONS busiest TILE_SIZE regions as rows of [x, y, edits], busiest first
+#   heatmap.png         log scaled image of pixels.npy, black for no edits through red and yellow to white
+#   density.npy  int64  summed-area table of the edits in DENSITY_CELL cells, entry [i, j] is every edit in the cells
+#                       left of i and above j, so the edits in any window of cells are 4 lookups
+#   info.json           time of the first event in ms plus the sizes used, so the buckets can be turned into times
+
+# returns the folder name of the activity stats for a year
+def activityName(year):
+    if year == 22:
+        return D_ACTIVITY
+    if year == 23:
+        return D_ACTIVITY23
+
+# adds counts to a running total, growing the total if the counts are longer
+def addCounts(total, counts):
+    if len(counts) > len(total):
+        total = np.concatenate((total, np.zeros((len(counts) - len(total),) + total.shape[1:], dtype=total.dtype)))
+    total[:len(counts)] += counts
+    return total
+
+# counts the edits of a whole year of the event store and saves them to the activity folder
+def buildActivity(year, total):
+    outdir = activityName(year)
+    # the stats only need to be built once
+    if os.path.exists(outdir):
+        return
+    setTime = time.time()
+    xGrid, yGrid = canvasSize(year)
+    pixels = np.zeros(xGrid * yGrid, dtype=np.int64)
+    colors = np.zeros((0, len(PALETTE)), dtype=np.int64)
+    seconds = np.zeros(0, dtype=np.int64)
+    bucket = ACTIVITY_MINUTES * 60 * 1000
+    start = None
+    for ds in range(100, (total + 100)):
+        storeDir = storeName(year, ds)
+        if not os.path.exists(storeDir):
+            continue
+        tCol, xCol, yCol, cCol = loadStore(storeDir)
+        if not len(tCol):
+            continue
+        if start is None:
+            start = int(tCol[0])
+        pixels += np.bincount(xCol.astype(np.int64) * yGrid + yCol, minlength=xGrid * yGrid)
+        offset = tCol - start
+        # events are in time order so the last one is in the latest bucket
+        buckets = offset // bucket
+        colors = addCounts(colors, np.bincount(buckets * len(PALETTE) + cCol, minlength=(int(buckets[-1]) + 1) *
+                                               len(PALETTE)).reshape(-1, len(PALETTE)))
+        seconds = addCounts(seconds, np.bincount(offset // 1000))
+    # without any events there's nothing to build, and empty stats would stop them being built once there are
+    if start is None:
+        return
+    pixels = pixels.reshape(xGrid, yGrid)
+    # add up the edits of each region, regions at the far edges can be smaller than TILE_SIZE
+    cols = -(-xGrid // TILE_SIZE)
+    rows = -(-yGrid // TILE_SIZE)
+    padded = np.zeros((cols * TILE_SIZE, rows * TILE_SIZE), dtype=np.int64)
+    padded[:xGrid, :yGrid] = pixels
+    regionEdits = padded.reshape(cols, TILE_SIZE, rows, TILE_SIZE).sum(axis=(1, 3))
+    busiest = np.argsort(regionEdits, axis=None, kind='stable')[::-1][:CONTESTED_REGIONS]
+    regions = np.stack([busiest // rows * TILE_SIZE, busiest % rows * TILE_SIZE, regionEdits.ravel()[busiest]], axis=1)
+    tmpdir = outdir + '.tmp'
+    os.makedirs(tmpdir, exist_ok=True)
+    np.save(os.path.join(tmpdir, 'pixels.npy'), pixels.astype(np.int32))
+    np.save(os.path.join(tmpdir, 'colors.npy'), colors)
+    np.save(os.path.join(tmpdir, 'seconds.npy'), seconds.astype(np.int32))
+    np.save(os.path.join(tmpdir, 'regions.npy'), regions)
+    np.save(os.path.join(tmpdir, 'density.npy'), summedArea(pixels))
+    # log scale so the quiet areas still show up next to the busiest pixels
+    usePygame()
+    heat = np.log1p(pixels) / max(np.log1p(pixels.max()), 1)
+    rgb = (np.clip(np.stack([heat * 3, heat * 3 - 1, heat * 3 - 2], axis=-1), 0, 1) * 255).astype(np.uint8)
+    pg.image.save(pg.surfarray.make_surface(rgb), os.path.join(tmpdir, 'heatmap.png'))
+    with open(os.path.join(tmpdir, 'info.json'), 'w') as f:
+        json.dump({'start': start, 'bucketMinutes': ACTIVITY_MINUTES, 'regionSize': TILE_SIZE}, f)
+    os.replace(tmpdir, outdir)
+    setTime = time.time() - setTime
+    print(f'20{year} activity built in {setTime:.1f} seconds')
+
+# turns per-pixel edit counts into a summed-area table of DENSITY_CELL cells
+def summedArea(pixels):
+    cols = -(-pixels.shape[0] // DENSITY_CELL)
+    rows = -(-pixels.shape[1] // DENSITY_CELL)
+    padded = np.zeros((cols * DENSITY_CELL, rows * DENSITY_CELL), dtype=np.int64)
+    padded[:pixels.shape[0], :pixels.shape[1]] = pixels
+    sat = np.zeros((cols + 1, rows + 1), dtype=np.int64)
+    sat[1:, 1:] = padded.reshape(cols, DENSITY_CELL, rows, DENSITY_CELL).sum(axis=(1, 3)).cumsum(axis=0).cumsum(axis=1)
+    return sat
+
+# returns the summed-area table of a year, or None without activity stats. Stats built before the table existed get it
+# added from their pixel counts
+def densityTable(year):
+    outdir = activityName(year)
+    if not os.path.exists(outdir):
+        return None
+    densityFile = os.path.join(outdir, 'density.npy')
+    if not os.path.exists(densityFile):
+        np.save(densityFile + '.tmp.npy', summedArea(np.load(os.path.join(outdir, 'pixels.npy'))))
+        os.replace(densityFile + '.tmp.npy', densityFile)
+    return np.load(densityFile)
+
+# edit counts of every place a window of a certain size can go, as a running total for picking one, a guide table
+# into it and how many places there are down each column. Made once for each year and window size
+DENSITY = {}
+
+# picks the top left corner of a width x height window, with a chance in proportion to how many edits are inside it.
+# Returns None if there are no activity stats to go by
+def pickActive(year, width, height):
+    key = (year, width, height)
+    if key not in DENSITY:
+        DENSITY[key] = None
+        sat = densityTable(year)
+        if sat is None:
+            return None
+        # the window in whole cells, and every cell it can start at and still fit on the canvas
+        cols = sat.shape[0] - 1
+        rows = sat.shape[1] - 1
+        w = min(max(width // DENSITY_CELL, 1), cols)
+        h = min(max(height // DENSITY_CELL, 1), rows)
+        nx = cols - w + 1
+        ny = rows - h + 1
+        edits = sat[w:w + nx, h:h + ny] - sat[:nx, h:h + ny] - sat[w:w + nx, :ny] + sat[:nx, :ny]
+        running = np.cumsum(edits.ravel())
+        if running[-1] == 0:
+            return None
+        # guide[k] is the first place the running total passes k / n of the way, so a pick only has to step forward
+        # from there. There's one guide entry per place, so that's about one step on average
+        guide = np.searchsorted(running, np.arange(len(running)) * (running[-1] / len(running)), side='right')
+        DENSITY[key] = (running, guide, ny)
+    if DENSITY[key] is None:
+        return None
+    running, guide, ny = DENSITY[key]
+    pick = random.random()
+    target = pick * running[-1]
+    i = guide[int(pick * len(running))]
+    while running[i] <= target:
+        i += 1
+    xGrid, yGrid = canvasSize(year)
+    # anywhere inside the picked cell
+    x = (i // ny) * DENSITY_CELL + random.randrange(DENSITY_CELL)
+    y = (i % ny) * DENSITY_CELL + random.randrange(DENSITY_CELL)
+    return min(x, max(xGrid - width, 0)), min(y, max(yGrid - height, 0))
+
+# prints a summary of the activity stats of a year, building them first if needed
+def activityReport(year):
+    if year == 22:
+        total = COUNT22
+    if year == 23:
+        total = COUNT23
+    if not any(os.path.exists(storeName(year, ds)) for ds in range(100, (total + 100))):
+        print(f'No event store for 20{year}, run prepare first')
+        return
+    buildActivity(year, total)
+    outdir = activityName(year)
+    if not os.path.exists(outdir):
+        print(f'No events in the event store for 20{year}')
+        return
+    with open(os.path.join(outdir, 'info.json')) as f:
+        info = json.load(f)
+    pixels = np.load(os.path.join(outdir, 'pixels.npy'), mmap_mode='r')
+    colors = np.load(os.path.join(outdir, 'colors.npy'))
+    seconds = np.load(os.path.join(outdir, 'seconds.npy'))
+    regions = np.load(os.path.join(outdir, 'regions.npy'))
+    start = info['start'] // 1000
+    print(f'20{year}: {int(seconds.sum())} events over {len(seconds)} seconds')
+    print(f'{np.count_nonzero(pixels)} pixels edited, the busiest {int(pixels.max())} times')
+    busiest = int(np.argmax(seconds))
+    busiestTime = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + busiest))
+    print(f'Busiest second: {busiestTime} UTC with {int(seconds[busiest])} events')
+    print('Most used colors: ' + ', '.join(f'{PALETTE[c]} {int(colors[:, c].sum())}'
+                                           for c in np.argsort(colors.sum(axis=0))[::-1][:5]))
+    print('Most contested regions:')
+    for x, y, edits in regions[:10]:
+        print(f'  x {x}-{x + info["regionSize"] - 1}, y {y}-{y + info["regionSize"] - 1}: {edits} edits')
+# ------------------------------------------------ End of code to build activity stats
+
+# ------------------------------------------------ Start of code to find canvas growth
+# The canvas opened up in EXPANSION_BLOCK sized blocks, so the part of the canvas in use is the events' bounds rounded
+# out to whole blocks. A file with events outside the bounds so far is where the canvas grew. The expansions folder
+# of a year holds:
+#   index.npy  int64  one row per stage of the canvas of [time in ms, file number, x min, y min, x max, y max], the
+#                     first row is the canvas at the start and the rest are in the order the canvas grew. Time is the
+#                     first event outside the stage before it and the bounds are inclusive
+#   {ds}.npy   uint8  palette indexes of the whole canvas from before the first event of file ds, for every stage
+#                     after the first
+
+# returns the folder name of the canvas growth index for a year
+def expansionName(year):
+    if year == 22:
+        return D_EXPANSIONS
+    if year == 23:
+        return D_EXPANSIONS23
+
+# returns the bounds of some events rounded out to whole blocks as x min, y min, x max, y max
+def blockBounds(xPos, yPos):
+    return (int(xPos.min()) // EXPANSION_BLOCK * EXPANSION_BLOCK, int(yPos.min()) // EXPANSION_BLOCK * EXPANSION_BLOCK,
+            (int(xPos.max()) // EXPANSION_BLOCK + 1) * EXPANSION_BLOCK - 1,
+            (int(yPos.max()) // EXPANSION_BLOCK + 1) * EXPANSION_BLOCK - 1)
+
+# replays a year of the event store to find each time the canvas grew and save the canvas from just before it
+def buildExpansions(year, total):
+    outdir = expansionName(year)
+    # the index only needs to be built once
+    if os.path.exists(outdir):
+        return
+    tmpdir = outdir + '.tmp'
+    os.makedirs(tmpdir, exist_ok=True)
+    canvas = np.full(canvasSize(year), WHITE, dtype=np.uint8)
+    stages = []
+    for ds in range(100, (total + 100)):
+        storeDir = storeName(year, ds)
+        if not os.path.exists(storeDir):
+            continue
+        tCol, xCol, yCol, cCol = loadStore(storeDir)
+        rects = loadRects(storeDir)
+        if not len(tCol):
+            applyTimed(canvas, tCol, xCol, yCol, cCol, rects)
+            continue
+        xCol = np.asarray(xCol)
+        yCol = np.asarray(yCol)
+        if not stages:
+            stages.append([int(tCol[0]), ds] + list(blockBounds(xCol, yCol)))
+        else:
+            xMin, yMin, xMax, yMax = stages[-1][2:]
+            outside = (xCol < xMin) | (xCol > xMax) | (yCol < yMin) | (yCol > yMax)
+            if outside.any():
+                # the new stage covers everything this file reaches from the first event outside the old one on
+                first = int(np.argmax(outside))
+                bounds = blockBounds(xCol[first:], yCol[first:])
+                stages.append([int(tCol[first]), ds, min(bounds[0], xMin), min(bounds[1], yMin),
+                               max(bounds[2], xMax), max(bounds[3], yMax)])
+                # the base is the canvas from before this file, moderation rectangles and all
+                np.save(os.path.join(tmpdir, f'{ds}.npy'), canvas)
+                print(f'20{year} canvas grew in file {ds} to x {stages[-1][2]}-{stages[-1][4]}, '
+                      f'y {stages[-1][3]}-{stages[-1][5]}')
+        applyTimed(canvas, tCol, xCol.astype(np.intp), yCol.astype(np.intp), cCol, rects)
+    np.save(os.path.join(tmpdir, 'index.npy'), np.array(stages, dtype=np.int64).reshape(-1, 6))
+    os.replace(tmpdir, outdir)
+
+# growth index of each year once it has been loaded
+EXPANSIONS = {}
+
+# returns the file number where the canvas position x, y first became part of the canvas and the whole canvas from
+# just before that file, or None if it was part of the canvas from the start or there's no growth index
+def expansionAt(year, x, y):
+    if year not in EXPANSIONS:
+        indexFile = os.path.join(expansionName(year), 'index.npy')
+        if not os.path.exists(indexFile):
+            return None
+        EXPANSIONS[year] = np.load(indexFile)
+    stages = EXPANSIONS[year]
+    # stages only ever grow, so the first one holding the position is when it opened
+    inside = (stages[:, 2] <= x) & (x <= stages[:, 4]) & (stages[:, 3] <= y) & (y <= stages[:, 5])
+    stage = int(np.argmax(inside))
+    if not inside[stage] or stage == 0:
+        return None
+    ds = int(stages[stage, 1])
+    return ds, canvasMap(os.path.join(expansionName(year), f'{ds}.npy'))
+# ------------------------------------------------ End of code to find canvas growth
+
+# ------------------------------------------------ Start of code to query the datasets
+# Lets other scripts read the prepared event store without playing it, for example:
+#   import PyPlacePlayer as place
+#   t, x, y, c = place.query(22, '2022-04-03 12:00:00 UTC', '2022-04-03 13:00:00 UTC', (1000, 0, 500, 500))
+#   canvas = place.canvasAt(23, '2023-07-25 20:00:00 UTC', (0, 0, 3000, 2000))
+# Times can be milliseconds since the epoch or timestamps written like the datasets write them. A box is
+# (x, y, width, height) on the canvas, leaving it out means the whole canvas. Colors are palette indexes, PALETTE_RGB
+# turns them into RGB.
+
+# turns a time given as a timestamp or as milliseconds into milliseconds
+def toMs(t):
+    if isinstance(t, str):
+        return utcToMs(t)
+    return int(t)
+
+# first and last event time of every store file of a year once they've been looked up, as file numbers, first times
+# and last times
+STORE_TIMES = {}
+
+# returns the file numbers of the store files of a year with the times of their first and last events
+def storeTimes(year):
+    if year not in STORE_TIMES:
+        total = COUNT22 if year == 22 else COUNT23
+        files = []
+        for ds in range(100, (total + 100)):
+            if os.path.exists(storeName(year, ds)):
+                tCol = loadStore(storeName(year, ds))[0]
+                if len(tCol):
+                    files.append((ds, int(tCol[0]), int(tCol[-1])))
+        STORE_TIMES[year] = tuple(np.array(col, dtype=np.int64) for col in zip(*files)) if files else \
+            (np.zeros(0, dtype=np.int64),) * 3
+    return STORE_TIMES[year]
+
+# returns the pixel events of a year from start up to end (not included) inside a box as t, x, y, c arrays in time
+# order. start or end left as None means from the beginning or to the end
+def query(year, start=None, end=None, box=None):
+    start = toMs(start) if start is not None else None
+    end = toMs(end) if end is not None else None
+    files, firsts, lasts = storeTimes(year)
+    # only the files whose time span overlaps the window
+    use = np.ones(len(files), dtype=bool)
+    if start is not None:
+        use &= lasts >= start
+    if end is not None:
+        use &= firsts < end
+    chunks = []
+    for ds in files[use]:
+        storeDir = storeName(year, int(ds))
+        tCol, xCol, yCol, cCol = loadStore(storeDir)
+        first = int(np.searchsorted(tCol, start)) if start is not None else 0
+        last = int(np.searchsorted(tCol, end)) if end is not None else len(tCol)
+        if box is None:
+            chunks.append((tCol[first:last], xCol[first:last], yCol[first:last], cCol[first:last]))
+            continue
+        # only read the events from tiles that touch the box
+        xOffset, yOffset, width, height = box
+        events = tileEvents(storeDir, xOffset, yOffset, width, height)
+        events = events[(events >= first) & (events < last)]
+        xPos = xCol[events]
+        yPos = yCol[events]
+        inBox = (xPos >= xOffset) & (xPos < xOffset + width) & (yPos >= yOffset) & (yPos < yOffset + height)
+        chunks.append((tCol[events][inBox], xPos[inBox], yPos[inBox], cCol[events][inBox]))
+    if not chunks:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.uint16),
+                np.zeros(0, dtype=np.uint8))
+    return tuple(np.concatenate(col) for col in zip(*chunks))
+
+# returns the 2022 moderation rectangles of a year from start up to end (not included) that touch a box, as rows of
+# [time in ms, x1, y1, x2, y2, palette index] in time order
+def queryRects(year, start=None, end=None, box=None):
+    start = toMs(start) if start is not None else None
+    end = toMs(end) if end is not None else None
+    rects = [loadRects(storeName(year, int(ds))) for ds in storeTimes(year)[0]]
+    rects = np.concatenate(rects + [np.zeros((0, 6), dtype=np.int64)])
+    use = np.ones(len(rects), dtype=bool)
+    if start is not None:
+        use &= rects[:, 0] >= start
+    if end is not None:
+        use &= rects[:, 0] < end
+    if box is not None:
+        xOffset, yOffset, width, height = box
+        use &= ((rects[:, 3] >= xOffset) & (rects[:, 1] < xOffset + width) & (rects[:, 4] >= yOffset) &
+                (rects[:, 2] < yOffset + height))
+    return rects[use]
+
+# returns the palette indexes of a box of the canvas as it was at time t, indexed [x, y]. Starts from the nearest
+# keyframe when they've been built
+def canvasAt(year, t, box=None):
+    if box is None:
+        box = (0, 0) + canvasSize(year)
+    return seekCanvas(year, toMs(t), *box)[0]
+# ------------------------------------------------ End of code to query the datasets
+
+# Reads data file into a list and sends it to the first viewport of the player for display
+def readFile(file, dataSet, player, year, filenumber):
+    view = player.views[0]
+    xOffset, yOffset, width, height = view.window()
     # initial value for 'checkTime' which will be used to see when the dataset has moved to the next second
     checkTime = False
     loopTime = time.time()
@@ -319,16 +1638,18 @@ def readFile(file, dataSet, xOffset, yOffset,year,filenumber):
             # try adds exception handling so program will not crash on errors
             try:
                 totalPixels += 1
-                xPos2 = False
-                yPos2 = False
                 # split line at every comma and assign each comma separated value to a variable
                 if year == 22:
-                    utc, null, hexValue, xPos, yPos = (line.split(','))
-                    #try:
-                    #    utc, null, hexValue, xPos, yPos = (line.split(','))
-                    #except:
-                    #    utc, null, hexValue, xPos, yPos, xPos2, yPos2 = (line.split(','))
-                    #    totalPixels += 1
+                    fields = line.split(',')
+                    # moderation rectangles have two corners, they fill in one go after the pixels before them
+                    if len(fields) == 7:
+                        if dataSet:
+                            readData(dataSet, view)
+                            dataSet.clear()
+                        view.fill(rectRow(fields[0], fields[2], fields[3:]))
+                        goodPixels += 1
+                        continue
+                    utc, null, hexValue, xPos, yPos = fields
                 if year == 23:
                     utc, xPos, yPos, hexValue = (line.split(','))
                     #try:
@@ -348,49 +1669,29 @@ def readFile(file, dataSet, xOffset, yOffset,year,filenumber):
                 #quit()
                 # remove extra data from x & y position values and convert to integer
                 xPos = int(xPos.strip('"'))
-                if not yPos2:
-                    if year == 22:
-                        yPos = int(yPos.rstrip('"\n'))
-                    if year == 23:
-                        yPos = int(yPos.rstrip('"'))
-                else:
-                    xPos2 = int(xPos2)
-                    yPos = int(yPos)
-                    yPos2 = int(yPos2.rstrip('"\n'))
+                if year == 22:
+                    yPos = int(yPos.rstrip('"\n'))
+                if year == 23:
+                    yPos = int(yPos.rstrip('"'))
                 # check if the current pixel being read falls within the window resolution
-                if xOffset <= xPos < (X_RES + xOffset) and yOffset <= yPos < (Y_RES + yOffset):
+                if xOffset <= xPos < (width + xOffset) and yOffset <= yPos < (height + yOffset):
                     goodPixels += 1
                     xPos -= xOffset
                     yPos -= yOffset
-                    if xPos2:
-                        if xOffset <= xPos2 < (X_RES + xOffset) and yOffset <= yPos2 < (Y_RES + yOffset):
-                            goodPixels += 1
-                            xPos2 -= xOffset
-                            yPos2 -= yOffset
-                    # break full date/time variable into smaller date and time variables
-                    date, dataTime, null = utc.split()
-                    # only take the first 8 characters from time to remove milliseconds
-                    dataTime = dataTime[:8]
-                    # split time variable into hours, minutes, seconds variables
-                    hTime, mTime, sTime = dataTime.split(':')
-                    # break each section of the hex value into r,g,b parts
-                    r = hexValue[1] + hexValue[2]
-                    g = hexValue[3] + hexValue[4]
-                    b = hexValue[5] + hexValue[6]
-                    # convert RGB 16 bit hex values into integers
-                    rgb = [int(r, 16), int(g, 16), int(b, 16)]
+                    # the date and time parts are always in the same spot in the timestamp
+                    date = utc[:10]
+                    hTime = utc[11:13]
+                    mTime = utc[14:16]
+                    # whole seconds since the epoch, used to tell when the dataset has moved to the next second
+                    sTime = utcToMs(utc) // 1000
+                    # look up the palette index of the hex color
+                    color = paletteIndex(hexValue)
                     # initialize variable pixel as class type PlacePixel
                     pixel = PlacePixel()
                     # assign information parsed from the line to the class
-                    pixel.set(date, hTime, mTime, sTime, rgb, xPos, yPos)
+                    pixel.set(date, hTime, mTime, sTime % 60, color, xPos, yPos)
                     # add an entry to the list with the class data
                     dataSet.append(pixel)
-                    if xPos2:
-                        # assign information parsed from the line to the class
-                        pixel.set(date, hTime, mTime, sTime, rgb, xPos2, yPos2)
-                        # add an entry to the list with the class data
-                        dataSet.append(pixel)
-                        print('Double entry added')
                     # check to see if the checkTime variable has been set
                     if not checkTime:
                         # if not, set it to the seconds value of current entry
@@ -399,10 +1700,9 @@ def readFile(file, dataSet, xOffset, yOffset,year,filenumber):
                     if checkTime != sTime:
                         # update checktime to the seconds value of current entry
                         checkTime = sTime
-                        # send dataset to the readData function, get array of pixel info returned
-                        pixelArray = readData(dataSet)
-                        # send array of pixel info to the pyGame function
-                        pyGame(pixelArray, getResize, filenumber)
+                        # send dataset to the readData function to write into the viewport, then draw it
+                        readData(dataSet, view)
+                        player.draw()
                         # clear dataset so it doesn't get too big
                         dataSet.clear()
                         # re-add current entry as starting point of new dataset
@@ -412,14 +1712,14 @@ def readFile(file, dataSet, xOffset, yOffset,year,filenumber):
             except ValueError:  # skips lines from the csv that do not contain pixel data
                 print('\n\n'+ file)
                 print(line)
-            loopTime = time.time() - loopTime
+            loopTime = (time.time() - loopTime) * 1000
             timeLoop += loopTime
             if loopTime > maxLoop:
-                maxLoop = loopTime * 1000
+                maxLoop = loopTime
             elif loopTime < minLoop:
-                minLoop = loopTime * 1000
+                minLoop = loopTime
             loopTime = time.time()
-    aveLoop = (aveLoop / totalPixels) * 1000
+    aveLoop = timeLoop / max(totalPixels, 1)
     print(file)
     print('%.2f ms Max loop time' % maxLoop)
     print('%.2f ms Minimum loop time' % minLoop)
@@ -429,41 +1729,387 @@ def readFile(file, dataSet, xOffset, yOffset,year,filenumber):
     print('%s Unused pixels in set' % badPixels)
     return dataSet
 
-# reads pixels from the dataset and returns an array of RGB values
-def readData(dataSet):
-    # read through the dataset from the first pixel requested until the end of the dataset
-    for x in range(len(dataSet)):
-        # assign the RGB values to an X,Y position in the array
+# reads the events of a store file that land in any of the windows, each given as (xOffset, yOffset, width, height).
+# Returns t, x, y, c arrays with x and y still canvas positions, skipping the events from before start. How many events
+# the file has and how many got read from its tiles go in stats if it's given
+def decodeViews(storeDir, windows, start=0, stats=None):
+    tCol, xCol, yCol, cCol = loadStore(storeDir)
+    totalPixels = len(tCol)
+    # only read the events from tiles that touch a window, tiles under more than one window only get read once
+    events = [tileEvents(storeDir, *window) for window in windows]
+    events = np.unique(np.concatenate(events)) if len(events) > 1 else events[0]
+    # skip events from before where playback was started
+    if start:
+        events = events[events >= start]
+    tCol = tCol[events]
+    xCol = xCol[events].astype(np.intp)
+    yCol = yCol[events].astype(np.intp)
+    cCol = cCol[events]
+    # find every event that falls within a window resolution
+    inWindow = np.zeros(len(events), dtype=bool)
+    for xOffset, yOffset, width, height in windows:
+        inWindow |= (xCol >= xOffset) & (xCol < width + xOffset) & (yCol >= yOffset) & (yCol < height + yOffset)
+    if stats:
+        stats.count('eventsInStore', totalPixels)
+        stats.count('eventsReadFromTiles', len(inWindow))
+    return tCol[inWindow], xCol[inWindow], yCol[inWindow], cCol[inWindow]
+
+# reads the events of a store file that land in the width x height window. Returns t, x, y, c arrays with x and y made relative to
+# the window, skipping the events from before start
+def decodeStore(storeDir, xOffset, yOffset, width, height, start=0):
+    tCol, xCol, yCol, cCol = decodeViews(storeDir, [(xOffset, yOffset, width, height)], start)
+    return tCol, xCol - xOffset, yCol - yOffset, cCol
+
+# returns a batch of pixels and rectangles from file ds in time order, with the times it starts and ends
+def makeBatch(ds, tCol, xCol, yCol, cCol, rects):
+    times = [int(tCol[0]), int(tCol[-1])] if len(tCol) else []
+    if len(rects):
+        times += [int(rects[0, 0]), int(rects[-1, 0])]
+    return ds, min(times), max(times), tCol, xCol, yCol, cCol, rects
+
+# background thread that decodes the store files of the viewports into batches of events, each covering step ms of
+# canvas time, and queues them for Player.play. It works up to DECODE_QUEUE batches ahead of the screen, so the next
+# file is already being read while the current one plays. Every viewport is fed from the same batches. A batch is
+# (ds, first time, last time, t, x, y, c, rects), with the moderation rectangles of the step as well as its pixels
+class Decoder(threading.Thread):
+
+    def __init__(self, year, files, views, firstEvent, step, stats=None):
+        super().__init__(daemon=True)
+        self.year = year
+        self.files = files
+        self.views = views
+        self.firstEvent = firstEvent
+        self.step = step
+        self.stats = stats
+        self.queue = queue.Queue(DECODE_QUEUE)
+        self.stopped = threading.Event()
+
+    def run(self):
         try:
-            pixelArray[dataSet[x].xPos, dataSet[x].yPos] = dataSet[x].rgb
-        except:
-            print(f'Error reading line {x}')
+            self.decode()
+        except Exception as error:
+            # hand the error to the player to raise, otherwise it would wait on the queue forever
+            self.put(error)
+        finally:
+            # tells the player there's nothing left
+            self.put(None)
+
+    # decodes every file into batches and queues them
+    def decode(self):
+        stats = self.stats
+        for ds in self.files:
+            if stats:
+                setTime = time.perf_counter()
+            # viewports that start from a later file already have this file's events in their starting image
+            windows = [view.window() for view in self.views if view.firstSet <= ds]
+            start = self.firstEvent if ds == self.files[0] else 0
+            tCol, xCol, yCol, cCol = decodeViews(storeName(self.year, ds), windows, start, stats)
+            rects = self.rects(ds, windows, start)
+            if stats:
+                stats.time('decodeFile', time.perf_counter() - setTime)
+                stats.count('eventsDecoded', len(tCol))
+            # every step of canvas time with a pixel or a rectangle in it gets a batch, so a rectangle shows up at its
+            # own time even when there are no pixels in the viewports around then
+            steps = np.union1d(tCol // self.step, rects[:, 0] // self.step) * self.step
+            pixelBounds = np.append(np.searchsorted(tCol, steps), len(tCol))
+            rectBounds = np.append(np.searchsorted(rects[:, 0], steps), len(rects))
+            for n in range(len(steps)):
+                pixels = slice(pixelBounds[n], pixelBounds[n + 1])
+                batch = makeBatch(ds, tCol[pixels], xCol[pixels], yCol[pixels], cCol[pixels],
+                                  rects[rectBounds[n]:rectBounds[n + 1]])
+                if not self.put(batch):
+                    return
+
+    # returns the moderation rectangles of a file that touch a window. Starting part way through a file, the ones from
+    # before the start are already in the starting image
+    def rects(self, ds, windows, start):
+        rects = loadRects(storeName(self.year, ds))
+        touches = np.zeros(len(rects), dtype=bool)
+        for xOffset, yOffset, width, height in windows:
+            touches |= ((rects[:, 3] >= xOffset) & (rects[:, 1] < xOffset + width) & (rects[:, 4] >= yOffset) &
+                        (rects[:, 2] < yOffset + height))
+        rects = rects[touches]
+        if start:
+            rects = rects[rects[:, 0] >= loadStore(storeName(self.year, ds))[0][start - 1]]
+        return rects[np.argsort(rects[:, 0], kind='stable')]
+
+    # waits for room in the queue, gives up and returns False if playback was stopped
+    def put(self, batch):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(batch, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def stop(self):
+        self.stopped.set()
+
+# reads pixels from the dataset and writes them into the viewport's pixel array with one assignment
+def readData(dataSet, view):
+    # pull the positions and colors out of the dataset into arrays so they can be written in one pass
+    xPos = np.fromiter((pixel.xPos for pixel in dataSet), dtype=np.intp, count=len(dataSet))
+    yPos = np.fromiter((pixel.yPos for pixel in dataSet), dtype=np.intp, count=len(dataSet))
+    colors = np.fromiter((pixel.color for pixel in dataSet), dtype=np.uint8, count=len(dataSet))
+    view.apply(xPos, yPos, colors)
     # return array of pixel data
-    return pixelArray
-
-# loop of the game engine that displays the data to screen
-def pyGame(pixelArray, savepoints, filenumber):
-    # turn array of pixel values into an image buffer
-    surface = pg.surfarray.make_surface(pixelArray)
-    surface = pg.transform.scale(surface, (X_RES * RES_SCALE, Y_RES * RES_SCALE))
-    # add the new image to the screen canvas starting at top left corner (0,0)
-    screen.blit(surface, (0, 0))
-    # update screen ouptut
-    pg.display.flip()
-    # check clock to keep maximum framerate at 60 FPS
-    clock.tick(60)
-    if savepoints:
-        global getResize
+    return view.pixelArray
+
+# One window onto the canvas. It keeps its own pixel array of palette indexes, which part of the canvas that is, how
+# much it's scaled up and where on the screen it goes, so several can play side by side from one event stream. It has
+# no hold on the screen itself, so it can be drawn into any player's surface
+class Viewport:
+
+    # pixelArray is the starting image of the window at xOffset, yOffset. It's drawn scale times bigger with its top
+    # left corner at left, top on the screen. firstSet is the file its starting image is from
+    def __init__(self, pixelArray, xOffset, yOffset, scale, left=0, top=0, firstSet=100):
+        self.pixelArray = pixelArray
+        self.xOffset = xOffset
+        self.yOffset = yOffset
+        self.scale = scale
+        self.left = left
+        self.top = top
+        self.firstSet = firstSet
+        # cells of the pixel array changed since the last frame was drawn
+        self.dirtyCells = []
+        # surfaces the frames are drawn into, kept between frames so nothing new gets made each frame
+        self.canvasSurface = None
+        self.scaledSurface = None
+        # the whole viewport has to be drawn the first time
+        self.drawn = False
+
+    # the part of the canvas this viewport shows as (xOffset, yOffset, width, height)
+    def window(self):
+        return (self.xOffset, self.yOffset) + self.pixelArray.shape
+
+    # writes events with canvas positions into the pixel array, skipping the ones outside the viewport
+    def applyCanvas(self, xPos, yPos, colors):
+        xPos = xPos - self.xOffset
+        yPos = yPos - self.yOffset
+        inside = (xPos >= 0) & (xPos < self.pixelArray.shape[0]) & (yPos >= 0) & (yPos < self.pixelArray.shape[1])
+        self.apply(xPos[inside], yPos[inside], colors[inside])
+
+    # writes pixels in time order and moderation rectangles with canvas positions into the pixel array. Each rectangle
+    # fills after the pixels with the same time or earlier, pixels in between rectangles are written in one go
+    def applyTimed(self, tCol, xPos, yPos, colors, rects):
+        pos = 0
+        for rect in rects:
+            end = int(np.searchsorted(tCol, rect[0], side='right'))
+            self.applyCanvas(xPos[pos:end], yPos[pos:end], colors[pos:end])
+            self.fill(rect)
+            pos = end
+        self.applyCanvas(xPos[pos:], yPos[pos:], colors[pos:])
+
+    # fills a moderation rectangle with canvas positions into the pixel array
+    def fill(self, rect):
+        filled = fillRect(self.pixelArray, rect, self.xOffset, self.yOffset)
+        if filled:
+            x1, y1, x2, y2 = filled
+            cellRows = self.pixelArray.shape[1] // DIRTY_CELL + 1
+            cellX = np.arange(x1 // DIRTY_CELL, (x2 - 1) // DIRTY_CELL + 1)
+            cellY = np.arange(y1 // DIRTY_CELL, (y2 - 1) // DIRTY_CELL + 1)
+            self.dirtyCells.append((cellX[:, None] * cellRows + cellY[None, :]).ravel())
+
+    # writes events with positions relative to the viewport into the pixel array with one assignment
+    def apply(self, xPos, yPos, colors):
+        pixelArray = self.pixelArray
+        # drop anything outside of the pixel array, the old loop skipped these with try/except
+        inside = (xPos >= 0) & (xPos < pixelArray.shape[0]) & (yPos >= 0) & (yPos < pixelArray.shape[1])
+        if not inside.all():
+            print(f'Error reading {np.count_nonzero(~inside)} pixels')
+            xPos = xPos[inside]
+            yPos = yPos[inside]
+            colors = colors[inside]
+        # a viewport can have nothing in a frame the other viewports do
+        if not len(xPos):
+            return
+        last = lastPlacement(xPos, yPos, pixelArray.shape[1])
+        pixelArray[xPos[last], yPos[last]] = colors[last]
+        # remember which cells changed so only those get drawn again
+        self.dirtyCells.append((xPos // DIRTY_CELL) * (pixelArray.shape[1] // DIRTY_CELL + 1) + yPos // DIRTY_CELL)
+
+    # draws what changed since the last frame onto the target surface, returns the areas of it that changed
+    def draw(self, target):
+        pixelArray = self.pixelArray
+        size = (round(pixelArray.shape[0] * self.scale), round(pixelArray.shape[1] * self.scale))
+        rects = self.dirtyRects() if self.drawn else None
+        self.drawn = True
+        # the surfaces are only made once for each viewport. They're 8 bit surfaces using the r/place palette, so the
+        # palette indexes only get turned into colors when drawn to the screen
+        if self.canvasSurface is None:
+            self.canvasSurface = pg.Surface(pixelArray.shape, 0, 8)
+            self.canvasSurface.set_palette(PALETTE_RGB.tolist())
+            self.scaledSurface = pg.Surface(size, 0, 8)
+            self.scaledSurface.set_palette(PALETTE_RGB.tolist())
+        # copy the array of palette indexes into the image buffer
+        pg.surfarray.blit_array(self.canvasSurface, pixelArray)
+        if rects is None:
+            self.dirtyCells = []
+            # scale it up into the buffer that's already the size of the viewport
+            pg.transform.scale(self.canvasSurface, size, self.scaledSurface)
+            # add the new image to the screen where the viewport goes
+            return [target.blit(self.scaledSurface, (self.left, self.top))]
+        # only scale and draw the parts that changed
+        updates = []
+        for rect in rects:
+            left = int(rect.left * self.scale)
+            top = int(rect.top * self.scale)
+            dest = pg.Rect(left, top, int(rect.right * self.scale) - left, int(rect.bottom * self.scale) - top)
+            dest = dest.clip(self.scaledSurface.get_rect())
+            if dest.width and dest.height:
+                pg.transform.scale(self.canvasSurface.subsurface(rect), dest.size, self.scaledSurface.subsurface(dest))
+                updates.append(target.blit(self.scaledSurface, dest.move(self.left, self.top), dest))
+        return updates
+
+    # turns the cells changed since the last frame into rectangles of the pixel array, cells next to each other in a
+    # column are joined into one rectangle. Returns None if so much changed that drawing everything is quicker
+    def dirtyRects(self):
+        if not self.dirtyCells:
+            return []
+        cells = np.unique(np.concatenate(self.dirtyCells))
+        self.dirtyCells = []
+        if not len(cells):
+            return []
+        cellRows = self.pixelArray.shape[1] // DIRTY_CELL + 1
+        if len(cells) > (self.pixelArray.shape[0] // DIRTY_CELL + 1) * cellRows // 2:
+            return None
+        cellX = cells // cellRows
+        cellY = cells % cellRows
+        # a new rectangle starts wherever the column changes or a cell gets skipped
+        breaks = np.flatnonzero((np.diff(cellX) != 0) | (np.diff(cellY) != 1)) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(cells)])) - 1
+        bounds = pg.Rect((0, 0), self.pixelArray.shape)
+        return [pg.Rect(int(cellX[start]) * DIRTY_CELL, int(cellY[start]) * DIRTY_CELL, DIRTY_CELL,
+                        int(cellY[end] - cellY[start] + 1) * DIRTY_CELL).clip(bounds)
+                for start, end in zip(starts, ends)]
+
+# One playback session. It owns the surface its viewports are drawn into, the clock and scheduler that pace them and
+# its stats, so nothing about playback lives in module globals and more than one can run at once. Only a player with
+# window set opens the display, there's only one of those in a process, the rest draw into a surface of their own
+class Player:
+
+    # opens a window of size, or draws into a surface of size that's never shown. speed and fps are the same as
+    # PLAYBACK_SPEED and FPS, fps 0 never waits on the clock. stats is a Stats to record playback in, or None
+    def __init__(self, size=(NATIVE_X_RES, NATIVE_Y_RES), window=True, speed=PLAYBACK_SPEED, fps=FPS, stats=None):
+        usePygame()
+        self.window = window
+        if window:
+            os.environ['SDL_AUDIODRIVER'] = 'dsp' # Don't need audio and ALSA kept crashing
+            # initialize pygame
+            pg.init()
+            # set display resolution to X & Y constants
+            self.screen = pg.display.set_mode(size)# pg.display.set_mode((GRID_SIZE23_X, GRID_SIZE23_Y))#
+            pg.mouse.set_visible(False)
+        else:
+            # the stats overlay still needs fonts
+            pg.font.init()
+            self.screen = pg.Surface(size)
+        # initialize pygame clock, will be used to lock framerate
+        self.clock = pg.time.Clock()
+        self.fps = fps
+        # keeps time for playback across all the files of the viewports
+        self.scheduler = FrameScheduler(speed)
+        self.stats = stats
+        # the viewports being played
+        self.views = []
+
+    # plays the event store files for the viewports. A Decoder thread reads the files while this loop only builds
+    # and draws frames, so reading a file never holds up the screen
+    def play(self, year, files, firstEvent=0):
+        stats = self.stats
+        # frames without a clock to wait on still cover the canvas time of a frame at FPS
+        step = max(int(self.scheduler.speed * 1000 / (self.fps or FPS)), 1)
+        decoder = Decoder(year, files, self.views, firstEvent, step, stats)
+        decoder.start()
+        # batches taken from the queue that haven't been fully shown yet
+        batches = []
+        finished = False
         try:
-            if filenumber in getResize:
-                pg.image.save(surface, f'2023_{filenumber}.png')
-                getResize.remove(filenumber)
-        except:
-            print(f'Error saving image for {filenumber}')
-
-def pickSpot(year):
-    global pixelArray
+            while batches or not finished:
+                # wait for the decoder if there's nothing ready to show
+                if not batches:
+                    batch = decoder.queue.get()
+                    if isinstance(batch, Exception):
+                        raise batch
+                    if batch is None:
+                        break
+                    batches.append(batch)
+                if stats:
+                    setTime = time.perf_counter()
+                    stats.gauge('queueDepth', decoder.queue.qsize())
+                due = self.scheduler.due(batches[0][1])
+                # pull in every queued batch that's already due. If drawing fell behind, the frames that were missed
+                # get merged into this one so playback stays in step with the clock
+                while not finished and batches[-1][2] <= due:
+                    try:
+                        batch = decoder.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+                    if batch is None:
+                        finished = True
+                    else:
+                        batches.append(batch)
+                # each part of the frame is the pixels and rectangles of a batch that are due
+                frame = []
+                while batches and batches[0][1] <= due:
+                    ds, first, last, tCol, xCol, yCol, cCol, rects = batches[0]
+                    end = int(np.searchsorted(tCol, due, side='right'))
+                    rectEnd = int(np.searchsorted(rects[:, 0], due, side='right'))
+                    frame.append((ds, tCol[:end], xCol[:end], yCol[:end], cCol[:end], rects[:rectEnd]))
+                    if end == len(tCol) and rectEnd == len(rects):
+                        batches.pop(0)
+                    else:
+                        batches[0] = makeBatch(ds, tCol[end:], xCol[end:], yCol[end:], cCol[end:], rects[rectEnd:])
+                if frame:
+                    for view in self.views:
+                        parts = [f for f in frame if f[0] >= view.firstSet]
+                        if parts:
+                            view.applyTimed(*[np.concatenate([f[n] for f in parts]) for n in range(1, 6)])
+                    if stats:
+                        stats.time('frameBuild', time.perf_counter() - setTime)
+                        stats.count('frames')
+                        # a frame should cover one step of canvas time, any more steps with something in them were
+                        # frames that got merged in because drawing fell behind. Steps with nothing to show don't count
+                        steps = np.unique(np.concatenate([f[1] // step for f in frame] +
+                                                         [f[5][:, 0] // step for f in frame]))
+                        stats.count('droppedFrames', max(len(steps) - 1, 0))
+                    self.draw()
+                else:
+                    # nothing new to show yet, wait for the next frame
+                    self.clock.tick(self.fps)
+                if stats:
+                    stats.tick()
+        finally:
+            decoder.stop()
+
+    # draws the changes to every viewport and waits for the next frame, returns the areas of the screen that changed
+    def draw(self):
+        stats = self.stats
+        if stats:
+            setTime = time.perf_counter()
+        updates = []
+        for view in self.views:
+            updates += view.draw(self.screen)
+        if stats and stats.overlay:
+            updates += stats.drawOverlay(self.screen, self.views[0].scaledSurface)
+        # only send the parts that changed to the screen
+        if self.window:
+            pg.display.update(updates)
+        if stats:
+            stats.time('render', time.perf_counter() - setTime)
+        # check clock to keep maximum framerate at fps
+        self.clock.tick(self.fps)
+        return updates
+
+# picks a width x height window of the canvas. Returns its position, the file it starts from and its starting image
+def pickSpot(year, width, height):
     firstSet = 100
+    # create array of palette indexes for pixels and set default to white
+    pixelArray = np.full((width, height), WHITE, dtype=np.uint8)
     if year == 22:
         xGrid = GRID_SIZE
         yGrid = GRID_SIZE
@@ -472,153 +2118,387 @@ def pickSpot(year):
         yGrid = GRID_SIZE23_Y
     xRand = random.randrange(xGrid)
     yRand = random.randrange(yGrid)
+    # some of the time pick the window by how much goes on inside it, so it doesn't sit on a part that never changes
+    if random.random() < ACTIVE_SHARE:
+        spot = pickActive(year, width, height)
+        if spot:
+            xRand, yRand = spot
     if xRand < RAND_TOLERANCE:
         xRand = 0
-    elif xRand > (xGrid - (RAND_TOLERANCE + X_RES)):
-        xRand = xGrid - X_RES
+    elif xRand > (xGrid - (RAND_TOLERANCE + width)):
+        xRand = xGrid - width
     if yRand < RAND_TOLERANCE:
         yRand = 0
-    elif yRand > (yGrid - (RAND_TOLERANCE + Y_RES)):
-        yRand = yGrid - Y_RES
-    if year == 22:
-        if xRand >= ( (xGrid / 2) - (X_RES / 2) ) and yRand < ( (yGrid / 2) - (Y_RES / 2) ):
-            firstSet = 113
-            bg = pg.image.load('xBase.png')
-            bg.convert()
-            rect = (xRand, yRand, X_RES, Y_RES)
-            bg = bg.subsurface(rect)
-            pixelArray = pg.surfarray.array3d(bg)
-            bg = pg.transform.scale(bg, (X_RES * RES_SCALE, Y_RES * RES_SCALE))
-            screen.blit(bg, (0, 0))
-        if yRand >= ( (GRID_SIZE / 2) - (Y_RES / 2) ):
-            firstSet = 134
-            bg = pg.image.load('yBase.png')
-            bg.convert()
-            rect = (xRand, yRand, X_RES, Y_RES)
-            bg = bg.subsurface(rect)
-            pixelArray = pg.surfarray.array3d(bg)
-            bg = pg.transform.scale(bg, (X_RES * RES_SCALE, Y_RES * RES_SCALE))
-            screen.blit(bg, (0, 0))
-    if year == 23:
-        if xRand > (2500 - (X_RES / 2)):
-            firstSet = 138
-        elif (2000 + (X_RES / 2)) > xRand > (2000 - (X_RES / 2)):
-            if (500 - (Y_RES / 2)) <= yRand < (1500 - (Y_RES / 2)):
-                firstSet = 109
-            elif 0 < yRand < (500 - (Y_RES / 2)):
-                firstSet = 121
-            elif (1500 - (Y_RES / 2)) < yRand:
-                firstSet = 128
-        elif (1000 - (X_RES / 2)) > xRand > (500 - (X_RES / 2)):
-            if (500 - (Y_RES / 2)) < yRand < (1500 - (Y_RES / 2)):
-                firstSet = 115
-            elif yRand < (500 - (Y_RES / 2)):
-                firstSet = 121
-            elif (1500 - (Y_RES / 2)) < yRand:
-                firstSet = 128
-        elif (500 - (X_RES / 2)) > xRand:
-            if (500 - (Y_RES / 2)) < yRand < (1500 - (Y_RES / 2)):
-                firstSet = 132
-        if yRand < (500 - (Y_RES / 2)):
-            if (500 - (X_RES / 2)) <= xRand < (2500 + (X_RES / 2)):
-                firstSet = 121
-            elif xRand < (500 - (X_RES / 2)):
-                firstSet = 132
-            else:
-                firstSet = 138
-        elif yRand > (1500 + (Y_RES / 2)):
-            if (500 - (X_RES / 2)) <= xRand < (2500 + (X_RES / 2)):
-                firstSet = 128
-            elif xRand < (500 - (X_RES / 2)):
-                firstSet = 132
-            else:
-                firstSet = 138
-        if firstSet != 100:
-            bg = pg.image.load(f'2023_{firstSet}.png')
-            bg.convert()
-            rect = (xRand, yRand, X_RES, Y_RES)
-            bg = bg.subsurface(rect)
-            pixelArray = pg.surfarray.array3d(bg)
-            bg = pg.transform.scale(bg, (X_RES * RES_SCALE, Y_RES * RES_SCALE))
-            screen.blit(bg, (0, 0))
-
-    return xRand, yRand, firstSet
+    elif yRand > (yGrid - (RAND_TOLERANCE + height)):
+        yRand = yGrid - height
+    # start from the file where the middle of the window became part of the canvas, with the canvas from then
+    expansion = expansionAt(year, xRand + width // 2, yRand + height // 2)
+    if expansion:
+        firstSet, base = expansion
+        region = base[xRand:xRand + width, yRand:yRand + height]
+        pixelArray[:region.shape[0], :region.shape[1]] = region
+
+    return xRand, yRand, firstSet, pixelArray
+
+# ------------------------------------------------ Start of code to export timelapses
+# Renders a region of the canvas to frames without a window, as fast as the data can be read. Each frame covers
+# speed / fps seconds of canvas time, the same as playback. Frames are written as numbered PNG files in a folder, or
+# as raw 8 bit RGB frames one after another (width * scale by height * scale, rows top to bottom) to a file or to
+# stdout with output '-', ready to pipe into something like ffmpeg.
+def exportVideo(year, xOffset, yOffset, width, height, scale=1, startTime=False, endTime=False, output='-',
+                format='raw', speed=PLAYBACK_SPEED, fps=FPS):
+    setTime = time.time()
+    step = max(int(speed * 1000 / fps), 1)
+    endMs = utcToMs(endTime) if endTime else False
+    if startTime:
+        # rebuild the region at the start time from the nearest keyframe
+        frameTime = utcToMs(startTime)
+        canvas, ds, firstEvent = seekCanvas(year, frameTime, xOffset, yOffset, width, height)
+    else:
+        frameTime = False
+        canvas = np.full((width, height), WHITE, dtype=np.uint8)
+        ds = 100
+        firstEvent = 0
+    # which pixel of the region each pixel of the scaled frame comes from
+    xScaled = (np.arange(round(width * scale)) / scale).astype(np.intp)
+    yScaled = (np.arange(round(height * scale)) / scale).astype(np.intp)
+    if format == 'png':
+        usePygame()
+        os.makedirs(output, exist_ok=True)
+        out = None
+    elif output == '-':
+        out = sys.stdout.buffer
+    else:
+        out = open(output, 'wb')
+    frames = 0
+
+    # writes the canvas as it is now as the next frame
+    def writeFrame():
+        nonlocal frames
+        rgb = PALETTE_RGB[canvas[xScaled][:, yScaled]]
+        if format == 'png':
+            pg.image.save(pg.surfarray.make_surface(rgb), os.path.join(output, f'{frames:06d}.png'))
+        else:
+            # surfarray order is x then y, video frames go row by row
+            out.write(np.ascontiguousarray(rgb.transpose(1, 0, 2)).tobytes())
+        frames += 1
+
+    # nothing but frames can go to stdout when that's where the frames are going
+    with contextlib.redirect_stdout(sys.stderr if out is sys.stdout.buffer else sys.stdout):
+        finished = False
+        # rectangles that come after the last frame time of a file, they go in once the frames get to them
+        carried = np.zeros((0, 6), dtype=np.int64)
+        while not finished and os.path.exists(storeName(year, ds)):
+            # the whole file's times say when it's finished, the region might have nothing in it for a long while
+            fullTime = loadStore(storeName(year, ds))[0]
+            tCol, xCol, yCol, cCol = decodeStore(storeName(year, ds), xOffset, yOffset, width, height, firstEvent)
+            rects = loadRects(storeName(year, ds))
+            # the rectangles from before the start time are already in the canvas
+            if firstEvent:
+                rects = rects[rects[:, 0] >= frameTime]
+            rects = np.concatenate((carried, rects))
+            firstEvent = 0
+            # without a start time the first frame is one step after the first event
+            if frameTime is False and len(fullTime):
+                frameTime = int(fullTime[0]) + step
+            pos = 0
+            rectPos = 0
+            while True:
+                if endMs and frameTime > endMs:
+                    finished = True
+                    break
+                # everything before the frame time is in the frame
+                end = int(np.searchsorted(tCol, frameTime))
+                rectEnd = int(np.searchsorted(rects[:, 0], frameTime))
+                applyTimed(canvas, tCol[pos:end], xCol[pos:end], yCol[pos:end], cCol[pos:end], rects[rectPos:rectEnd],
+                           xOffset, yOffset)
+                pos = end
+                rectPos = rectEnd
+                # the frame carries on into the next file once it's past every event of this one
+                if not len(fullTime) or frameTime > fullTime[-1]:
+                    carried = rects[rectPos:]
+                    break
+                writeFrame()
+                frameTime += step
+            ds += 1
+        # rectangles after the last pixel of the dataset still go in the last frame
+        if not finished and len(carried):
+            if endMs:
+                carried = carried[carried[:, 0] <= endMs]
+            applyTimed(canvas, tCol[:0], xCol[:0], yCol[:0], cCol[:0], carried, xOffset, yOffset)
+        # the last frame with everything up to the end
+        writeFrame()
+        if out is not None and out is not sys.stdout.buffer:
+            out.close()
+        setTime = time.time() - setTime
+        print(f'{frames} frames exported in {setTime:.1f} seconds')
+# ------------------------------------------------ End of code to export timelapses
+
+# ------------------------------------------------ Start of code to benchmark
+# Makes synthetic datasets laid out like the real ones and times every stage on them, so changes can be measured
+# without downloading the real datasets. Each stage reports its time in seconds and how many events it got through.
+
+# writes files of synthetic events for a year into the current folder. 2022 files are written as sorted files and
+# 2023 files as raw files, which is where each year's preparation picks them up. A hotspots share of the events are
+# placed around a few busy spots and the rest anywhere on the canvas. Events come in at rate per second, shuffled
+# inside each file like the real files. With source set, every file is also written to that folder as the raw .gzip
+# file it would be downloaded as, for streaming.
+def makeSyntheticData(year, events, files, hotspots=8, hotShare=0.7, rate=500, seed=0, source=False):
+    rng = np.random.default_rng(seed)
+    xGrid, yGrid = canvasSize(year)
+    centers = rng.integers(0, (xGrid, yGrid), size=(max(hotspots, 1), 2))
+    start = utcToMs('2022-04-01 13:00:00 UTC' if year == 22 else '2023-07-20 13:00:00 UTC')
+    perFile = events // files
+    for n in range(files):
+        count = perFile if n < files - 1 else events - perFile * (files - 1)
+        tCol = start + ((np.arange(count) + n * perFile) * 1000 / rate).astype(np.int64)
+        hot = rng.random(count) < (hotShare if hotspots else 0)
+        spots = centers[rng.integers(0, len(centers), count)]
+        xCol = np.where(hot, rng.normal(spots[:, 0], 40), rng.integers(0, xGrid, count)).astype(np.int64)
+        yCol = np.where(hot, rng.normal(spots[:, 1], 40), rng.integers(0, yGrid, count)).astype(np.int64)
+        xCol = np.clip(xCol, 0, xGrid - 1)
+        yCol = np.clip(yCol, 0, yGrid - 1)
+        colors = rng.integers(0, len(PALETTE), count)
+        order = rng.permutation(count)
+        stamps = [time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t // 1000)) + f'.{t % 1000:03d} UTC' for t in tCol.tolist()]
+        if year == 22:
+            outFile = sortedName(year, n + 100)
+            lines = ['timestamp,user_id,pixel_color,coordinate\n']
+            lines += [f'{stamps[i]},user,{PALETTE[colors[i]]},"{xCol[i]},{yCol[i]}"\n' for i in order]
+        if year == 23:
+            # raw 2023 positions are centered on 0,0
+            outFile = rawName(year, n)
+            lines = ['timestamp,user,coordinate,pixel_color\n']
+            lines += [f'{stamps[i]},user,"{xCol[i] - 1500},{yCol[i] - 1000}",{PALETTE[colors[i]]}\n' for i in order]
+        with open(outFile, 'w') as f:
+            f.writelines(lines)
+        if source:
+            with gzip.open(sourceName(year, n, source), 'wt') as f:
+                f.writelines(lines)
+
+# times a stage, returns its report entry and whatever the stage returned
+def timeStage(events, stage, *args):
+    setTime = time.perf_counter()
+    result = stage(*args)
+    setTime = time.perf_counter() - setTime
+    return {'seconds': round(setTime, 4), 'events': events, 'eventsPerSecond': round(events / max(setTime, 1e-9))}, result
+
+# decodes and applies a viewport's events frame by frame the way playback does, returns how many frames and events
+def benchmarkApply(year, files, view, step):
+    frames = 0
+    events = 0
+    for ds in files:
+        tCol, xCol, yCol, cCol = decodeStore(storeName(year, ds), *view.window())
+        bounds = np.flatnonzero(np.diff(tCol // step)) + 1
+        for batch in zip(np.split(xCol, bounds), np.split(yCol, bounds), np.split(cCol, bounds)):
+            view.apply(*batch)
+            frames += 1
+        events += len(tCol)
+    return frames, events
+
+# draws frames of a viewport without waiting on the clock
+def benchmarkRender(frames, view):
+    # a framerate of 0 means the clock never waits, and there's nothing to look at so it needs no window
+    player = Player(window=False, fps=0)
+    player.views = [view]
+    width, height = view.pixelArray.shape
+    rng = np.random.default_rng(0)
+    for n in range(frames):
+        # change a few spots each frame like a busy second would
+        view.apply(rng.integers(0, width, 200), rng.integers(0, height, 200),
+                   rng.integers(0, len(PALETTE), 200).astype(np.uint8))
+        player.draw()
+
+# makes a synthetic dataset in a temporary folder, runs every stage on it and returns the report
+def benchmark(year=22, events=1000000, files=4, hotspots=8, frames=600, seed=0):
+    report = {'year': year, 'events': events, 'files': files, 'hotspots': hotspots, 'stages': {}}
+    stages = report['stages']
+    home = os.getcwd()
+    workDir = tempfile.mkdtemp(prefix='placebench')
+    source = os.path.join(workDir, 'source')
+    os.makedirs(source)
+    os.chdir(workDir)
+    try:
+        # all the stage printing goes to stderr so the report can be read from stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            stages['generate'], null = timeStage(events, makeSyntheticData, year, events, files, hotspots, 0.7, 500,
+                                                 seed, source)
+            if year == 23:
+                jobs = [(normalizeFile, (year, ds)) for ds in range(files)]
+                stages['normalize'], null = timeStage(events, runPool, jobs, 'Normalize 23')
+            stages['order'], null = timeStage(events, orderDataset, year, files)
+            # the stores are converted without their tile index, so building it gets timed on its own
+            jobs = [(convertFile, (orderedName(year, ds), storeName(year, ds), year, False))
+                    for ds in range(100, files + 100)]
+            stages['parse'], null = timeStage(events, runPool, jobs, f'Convert {year}')
+            stages['tile_index'], null = timeStage(events, lambda: [buildTileIndex(storeName(year, ds))
+                                                                    for ds in range(100, files + 100)])
+            # the default path streams the .gzip files straight into stores. It writes stores with the same names, so
+            # it runs in its own folder
+            os.makedirs('stream')
+            os.chdir('stream')
+            jobs = [(streamFile, (year, ds, source)) for ds in range(files)]
+            stages['stream'], null = timeStage(events, runPool, jobs, f'Stream {year}')
+            stages['merge'], null = timeStage(events, mergeStores, year, files, SORT_MEMORY_MB, False)
+            os.chdir(workDir)
+            stages['keyframes'], null = timeStage(events, buildKeyframes, year, files)
+            # apply and render the way playback would at scale 2
+            scale = 2
+            width = round(NATIVE_X_RES / scale)
+            height = round(NATIVE_Y_RES / scale)
+            xGrid, yGrid = canvasSize(year)
+            rng = np.random.default_rng(seed)
+            view = Viewport(np.full((width, height), WHITE, dtype=np.uint8), int(rng.integers(0, xGrid - width)),
+                            int(rng.integers(0, yGrid - height)), scale)
+            step = max(int(PLAYBACK_SPEED * 1000 / FPS), 1)
+            stages['frame_apply'], applied = timeStage(0, benchmarkApply, year, list(range(100, files + 100)), view,
+                                                       step)
+            # only the events in the window get applied
+            stages['frame_apply']['frames'], stages['frame_apply']['events'] = applied
+            stages['frame_apply']['eventsPerSecond'] = round(applied[1] / max(stages['frame_apply']['seconds'], 1e-9))
+            stages['render'], null = timeStage(frames * 200, benchmarkRender, frames, view)
+            stages['render']['frames'] = frames
+            stages['render']['framesPerSecond'] = round(frames / max(stages['render']['seconds'], 1e-9))
+    finally:
+        os.chdir(home)
+        shutil.rmtree(workDir)
+    return report
+# ------------------------------------------------ End of code to benchmark
 
 # main code loop
 def main():
-    # make sure end of dataset is downloaded and sorted before continuing
-    if not (os.path.exists(D_SORTED + '178' + D_EXT) or os.path.exists(D_ORDERED + '178' + D_EXT)):
-        # if it doesn't find the sorted version of the final dataset, check all files
-        checkDataset(22,COUNT22)
-    # make sure end of dataset is chronologically ordered before continuing
-    if not os.path.exists(D_ORDERED + '178' + D_EXT):
-        # if it doesn't find the sorted version of the final dataset, check all files
-        orderDataset(22,COUNT22)
-    if not os.path.exists(D_ORDERED23 + '152' + D_EXT):
-        for i in range(COUNT23):
-            num = str(i)
-            if i < 10:
-                num = '0' + str(i)
-            outfile = f"{D_ORDERED23}1{num}{D_EXT}"
-            if not os.path.exists(outfile):
-                # Format the file number with leading zeros
-                file_number = f"{i:012}"
-                # Create input and output filenames
-                infile = f"2023_place_canvas_history-{file_number}.csv"
-                normalizeData(infile, outfile, 23)
+    # make sure both datasets are downloaded, ordered and converted before continuing
+    prepare(22)
+    prepare(23)
+    # the window everything plays in
+    player = Player(stats=Stats(STATS) if STATS else None)
     # create empty list to store info from the dataset
     dataSet = []
     # pygame variable to exit loop
     running = True
     # start of pygame loop
     while running:
-        global RES_SCALE
-        global X_RES
-        global Y_RES
-        global pixelArray
         pickyear=random.randrange(22,24)
+        # a start time picks the year it's from
+        if START_TIME:
+            pickyear = int(START_TIME[2:4])
         if pickyear == 22:
             rangeyear = 179
         if pickyear == 23:
             rangeyear = 153
-        RES_SCALE = random.randrange(0,MAX_SCALE)
-        if RES_SCALE == 0:
-            RES_SCALE = random.randrange(0,MAX_SCALE)
-            if RES_SCALE == 0:
-                RES_SCALE = 0.5
-        X_RES = round(NATIVE_X_RES / RES_SCALE)
-        Y_RES = round(NATIVE_Y_RES / RES_SCALE)
-        # create array for pixels and set default to white
-        pixelArray = np.full((X_RES, Y_RES, 3), 255)
-        xOffset, yOffset, firstSet = pickSpot(pickyear)
-        if getResize:
-            xOffset=0
-            yOffset=0
-            RES_SCALE = 1
-            X_RES = GRID_SIZE23_X
-            Y_RES = GRID_SIZE23_Y
-            pixelArray = np.full((X_RES, Y_RES, 3), 255)
-            firstSet = 100
-            rangeyear = 153
-            pickyear = 23
+        # every viewport of the grid gets an equal share of the window
+        cols, rows = VIEW_GRID
+        cellWidth = NATIVE_X_RES // cols
+        cellHeight = NATIVE_Y_RES // rows
+        player.views = []
+        for n in range(cols * rows):
+            scale = random.randrange(0,MAX_SCALE)
+            if scale == 0:
+                scale = random.randrange(0,MAX_SCALE)
+                if scale == 0:
+                    scale = 0.5
+            xOffset, yOffset, firstSet, pixelArray = pickSpot(pickyear, round(cellWidth / scale),
+                                                              round(cellHeight / scale))
+            player.views.append(Viewport(pixelArray, xOffset, yOffset, scale, (n % cols) * cellWidth,
+                                         (n // cols) * cellHeight, firstSet))
+        startEvent = 0
+        # each set of viewports plays from its own start
+        player.scheduler.reset()
+        # rebuild the windows at the start time from the nearest keyframe and continue from there
+        if START_TIME and os.path.exists(keyframeName(pickyear)):
+            for view in player.views:
+                view.pixelArray, view.firstSet, startEvent = seekCanvas(pickyear, utcToMs(START_TIME), *view.window())
+            player.scheduler.reset(utcToMs(START_TIME))
+        # one pass over the files feeds every viewport, starting from the earliest one
+        firstSet = min(view.firstSet for view in player.views)
+        # play from the binary event store when it has been built
+        files = [ds for ds in range(firstSet, rangeyear) if os.path.exists(storeName(pickyear, ds))]
+        if files:
+            setTime = time.time()
+            player.play(pickyear, files, startEvent)
+            setTime = time.time() - setTime
+            print('Viewports played in %s seconds' % setTime)
+            continue
+        # the csv files can only be played in one viewport
+        player.views = player.views[:1]
+        firstSet = player.views[0].firstSet
         # loop through ds values of 100-178 (always stops before end value). Since we made our filenames start at 100,
         # we don't need to do any additional padding for numbers below 10 and can just convert all values to strings
         for ds in range(firstSet, rangeyear):
             # make string of our new filename plus current number plus extension
-            if pickyear == 22:
-                dsFile = D_ORDERED + str(ds) + D_EXT
-            if pickyear == 23:
-                dsFile = D_ORDERED23 + str(ds) + D_EXT
+            dsFile = orderedName(pickyear, ds)
             # checks to see if data file exists before running function
             if os.path.exists(dsFile):
                 setTime = time.time()
                 print(pickyear)
                 # sends the filename to the readFile function for processing and display
-                dataSet = readFile(dsFile, dataSet, xOffset, yOffset, pickyear, ds)
+                dataSet = readFile(dsFile, dataSet, player, pickyear, ds)
                 setTime = time.time() - setTime
                 print('Dataset processed in %s seconds' % setTime)
 
 # python way of checking if this is the main program, i.e. this code isn't being called from 'import xxx'
 if __name__ == '__main__':
-    # calls the main loop, this is the line that actually starts the program moving
-    main()
+    parser = argparse.ArgumentParser(description='Plays the r/place datasets as a timelapse')
+    parser.add_argument('--stats', default=STATS,
+                        help="file to log playback stats to as json lines, or 'overlay' to draw them on screen")
+    parser.add_argument('--grid', default=None, help="split the window into columns x rows of viewports, like 2x2")
+    commands = parser.add_subparsers(dest='command')
+    prepCommand = commands.add_parser('prepare', help='download and prepare the datasets without playing them')
+    prepCommand.add_argument('--year', type=int, choices=[22, 23], action='append',
+                             help='year to prepare, can be given more than once (default both)')
+    prepCommand.add_argument('--workers', type=int, default=PREP_WORKERS, help='number of processes to use')
+    prepCommand.add_argument('--memory', type=int, default=SORT_MEMORY_MB,
+                             help='most megabytes of memory to use while ordering')
+    prepCommand.add_argument('--source', default=SOURCE,
+                             help='folder or url holding the .gzip datasets (default reddit)')
+    prepCommand.add_argument('--csv', action='store_true',
+                             help='unpack the datasets to csv files on disk instead of streaming them')
+    exportCommand = commands.add_parser('export', help='render a region to frames without a window')
+    exportCommand.add_argument('--year', type=int, choices=[22, 23], required=True)
+    exportCommand.add_argument('--x', type=int, default=0, help='left edge of the region on the canvas')
+    exportCommand.add_argument('--y', type=int, default=0, help='top edge of the region on the canvas')
+    exportCommand.add_argument('--width', type=int, default=NATIVE_X_RES)
+    exportCommand.add_argument('--height', type=int, default=NATIVE_Y_RES)
+    exportCommand.add_argument('--scale', type=float, default=1, help='size of each canvas pixel in the frames')
+    exportCommand.add_argument('--start', default=False, help="time to start at, like '2022-04-03 12:00:00 UTC'")
+    exportCommand.add_argument('--end', default=False, help='time to stop at')
+    exportCommand.add_argument('--speed', type=float, default=PLAYBACK_SPEED,
+                               help='seconds of canvas time per second of video')
+    exportCommand.add_argument('--fps', type=int, default=FPS)
+    exportCommand.add_argument('--format', choices=['raw', 'png'], default='raw')
+    exportCommand.add_argument('--output', default='-', help="file for raw frames ('-' for stdout) or folder for png")
+    analyzeCommand = commands.add_parser('analyze', help='count edits, colors and busy regions of the event store')
+    analyzeCommand.add_argument('--year', type=int, choices=[22, 23], action='append',
+                                help='year to analyze, can be given more than once (default both)')
+    benchCommand = commands.add_parser('benchmark', help='time every stage on a synthetic dataset')
+    benchCommand.add_argument('--year', type=int, choices=[22, 23], default=22, help='dataset layout to copy')
+    benchCommand.add_argument('--events', type=int, default=1000000, help='number of synthetic events')
+    benchCommand.add_argument('--files', type=int, default=4, help='number of files to split the events into')
+    benchCommand.add_argument('--hotspots', type=int, default=8, help='number of busy spots, 0 spreads events evenly')
+    benchCommand.add_argument('--frames', type=int, default=600, help='number of frames to render')
+    benchCommand.add_argument('--seed', type=int, default=0)
+    benchCommand.add_argument('--output', default='-', help="file to write the json report to ('-' for stdout)")
+    args = parser.parse_args()
+    if args.command == 'prepare':
+        STREAM = not args.csv
+        for year in args.year or [22, 23]:
+            prepare(year, args.workers, args.memory, args.source)
+    elif args.command == 'analyze':
+        for year in args.year or [22, 23]:
+            activityReport(year)
+    elif args.command == 'benchmark':
+        report = benchmark(args.year, args.events, args.files, args.hotspots, args.frames, args.seed)
+        if args.output == '-':
+            print(json.dumps(report, indent=2))
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    elif args.command == 'export':
+        exportVideo(args.year, args.x, args.y, args.width, args.height, args.scale, args.start, args.end, args.output,
+                    args.format, args.speed, args.fps)
+    else:
+        STATS = args.stats
+        if args.grid:
+            VIEW_GRID = tuple(int(n) for n in args.grid.lower().split('x'))
+        # calls the main loop, this is the line that actually starts the program moving
+        main()